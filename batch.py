@@ -0,0 +1,386 @@
+#!/usr/bin/python3
+"""
+Analyze a list of archives in shards with any number of workers and hosts.
+
+    batch.py plan RUN --file-list files_2021.txt --shard-size 4
+    batch.py launch RUN --launcher ssh --hosts cobalt07 cobalt08 --jobs 16 \\
+        --setup 'source ~/source_python37.sh' --remote-dir ~/analyze_hitbuffer
+    batch.py merge RUN -o result.json.gz
+
+`plan` splits the archives into the shards of RUN/manifest.json. Workers
+(`work`, started by hand or by `launch`) claim a shard by creating
+RUN/shards/<shard>.lock exclusively, so RUN must be on a file system shared by
+all hosts. The records of a shard are written to RUN/shards/<shard>.jsonl.gz,
+sorted by time, then RUN/shards/<shard>.json marks the shard as done and lists
+its failed archives. Shards with failed archives are analyzed again, up to
+--attempts times. A worker touches its lock while it runs, locks that were not
+touched for --stale seconds (ssh session dropped, node rebooted) are taken
+over by the next worker. Each lock holds the token of its owner, a worker that
+finds its lock taken over stops touching it and discards its records. `merge`
+combines the shards into one result file sorted by time.
+"""
+import argparse
+import contextlib
+import gzip
+import heapq
+import json
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+import read_data
+import result_store
+from shared_files import write_json
+
+MANIFEST_VERSION = 1
+
+
+def worker_name() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+@contextlib.contextmanager
+def heartbeat(beat: Callable[[], bool], interval: float) -> Iterator[None]:
+    """ call beat every interval seconds while the body runs, until it returns False """
+    stop = threading.Event()
+
+    def touch():
+        while not stop.wait(interval):
+            if not beat():
+                return
+
+    thread = threading.Thread(target=touch, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+class Run:
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.shards_dir = self.directory / 'shards'
+        with open(self.directory / 'manifest.json') as f:
+            self.manifest = json.load(f)
+        self.shards: List[List[str]] = self.manifest['shards']
+
+    @staticmethod
+    def create(directory: Path, archives: Sequence[str], shard_size: int, backend: str, histograms: bool) -> 'Run':
+        directory = Path(directory)
+        (directory / 'shards').mkdir(parents=True, exist_ok=True)
+        write_json(directory / 'manifest.json', {
+            'version': MANIFEST_VERSION,
+            # every worker analyzes with the same settings
+            'backend': backend,
+            'histograms': histograms,
+            'shards': [list(archives[i:i + shard_size]) for i in range(0, len(archives), shard_size)],
+        })
+        return Run(directory)
+
+    def path(self, k: int, suffix: str) -> Path:
+        return self.shards_dir / f'{k:04d}{suffix}'
+
+    def status(self, k: int) -> Optional[dict]:
+        try:
+            with open(self.path(k, '.json')) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def is_done(self, k: int, attempts: int) -> bool:
+        """ analyzed without failures, or failed attempts times """
+        status = self.status(k)
+        return status is not None and (not status['failed'] or status['attempt'] >= attempts)
+
+    def claim(self, k: int, stale: float) -> Optional[str]:
+        """ lock shard k, returns the owner token of the lock or None if another worker holds it """
+        lock = self.path(k, '.lock')
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                age = time.time() - lock.stat().st_mtime
+            except FileNotFoundError:
+                # released meanwhile, picked up in the next pass
+                return None
+            if age < stale:
+                return None
+            taken = lock.with_name(f'{lock.name}.{socket.gethostname()}.{os.getpid()}')
+            try:
+                os.rename(lock, taken)
+            except FileNotFoundError:
+                return None
+            # another worker may have taken over the stale lock between the
+            # stat and the rename, then the renamed lock is its fresh one
+            if time.time() - taken.stat().st_mtime < stale:
+                # put it back without replacing a lock created meanwhile
+                with contextlib.suppress(FileExistsError):
+                    os.link(taken, lock)
+                taken.unlink()
+                return None
+            taken.unlink()
+            print(f'{lock}: taken over after {age:.0f} s', file=sys.stderr)
+            return self.claim(k, stale)
+        token = f'{worker_name()}:{os.urandom(8).hex()}'
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'worker': worker_name(), 'time': time.time(), 'token': token}, f)
+        return token
+
+    def owner(self, k: int) -> Optional[str]:
+        """ token of the worker holding the lock of shard k """
+        try:
+            with open(self.path(k, '.lock')) as f:
+                return json.load(f)['token']
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+
+    def touch(self, k: int, token: str) -> bool:
+        """ keep the lock of shard k fresh, False once another worker owns it """
+        owner = self.owner(k)
+        if owner is not None and owner != token:
+            print(f'{self.path(k, ".lock")}: taken over by another worker', file=sys.stderr)
+            return False
+        # no owner while claim() has renamed the lock aside or a new lock is
+        # not written yet, the lock is still ours until another token shows up
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(self.path(k, '.lock'))
+        return True
+
+    def release(self, k: int, token: str):
+        # a lock that was taken over belongs to the new owner
+        if self.owner(k) == token:
+            with contextlib.suppress(FileNotFoundError):
+                self.path(k, '.lock').unlink()
+
+    def write_shard(self, k: int, records: List[dict], failed: List[str]):
+        status = self.status(k)
+        with result_store.open_writer(str(self.path(k, '.jsonl.gz')), read_data.thresholds_mip) as writer:
+            for record in records:
+                writer.write(record)
+        # written last, marks the shard as done
+        write_json(self.path(k, '.json'), {
+            'attempt': 1 if status is None else status['attempt'] + 1,
+            'worker': worker_name(),
+            'records': len(records),
+            'failed': failed,
+        })
+
+    def read_shard(self, k: int) -> Iterator[dict]:
+        with gzip.open(self.path(k, '.jsonl.gz'), 'rt') as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def analyze_shard(run: Run, k: int, jobs: int) -> Tuple[List[dict], List[str]]:
+    """ records sorted by time and failed archives of shard k """
+    records: List[dict] = []
+    failed = read_data.analyze_archives(run.shards[k], jobs, emit=records.append)
+    # archives in shard order, each in time order
+    records.sort(key=lambda r: r['time'])
+    return records, failed
+
+
+def work(run: Run, jobs: int = 1, attempts: int = 3, stale: float = 1800) -> int:
+    """
+    analyze shards until all are done or claimed by other workers, returns
+    the number of shards analyzed
+    """
+    read_data.init_worker(run.manifest['backend'], run.manifest['histograms'])
+    analyzed = 0
+    while True:
+        claimed = False
+        for k in range(len(run.shards)):
+            if run.is_done(k, attempts):
+                continue
+            token = run.claim(k, stale)
+            if token is None:
+                continue
+            try:
+                # another worker may have finished it between the checks
+                if not run.is_done(k, attempts):
+                    with heartbeat(lambda: run.touch(k, token), stale / 10):
+                        records, failed = analyze_shard(run, k, jobs)
+                    # the new owner writes the shard
+                    if run.owner(k) == token:
+                        run.write_shard(k, records, failed)
+                        analyzed += 1
+                    else:
+                        print(f'{run.path(k, ".lock")}: lost, records of shard {k:04d} discarded', file=sys.stderr)
+                    claimed = True
+            finally:
+                run.release(k, token)
+        # failed shards are retried in the next pass
+        if not claimed:
+            return analyzed
+
+
+class LocalLauncher:
+    """ worker processes on this host """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+
+    def start(self, arguments: List[str]) -> List[subprocess.Popen]:
+        command = [sys.executable, str(Path(__file__).resolve()), *arguments]
+        return [subprocess.Popen(command) for _ in range(self.workers)]
+
+
+class SshLauncher:
+    """ one worker per host, the code must be in remote_dir on every host """
+
+    def __init__(self, hosts: Sequence[str], remote_dir: str, setup: Optional[str] = None):
+        self.hosts = hosts
+        self.remote_dir = remote_dir
+        self.setup = setup
+
+    def start(self, arguments: List[str]) -> List[subprocess.Popen]:
+        command = ' '.join(shlex.quote(a) for a in ['python3', 'batch.py', *arguments])
+        if self.setup is not None:
+            command = f'{self.setup} && {command}'
+        # ~ is expanded by the remote shell
+        command = f'cd {self.remote_dir} && {command}'
+        return [subprocess.Popen(['ssh', host, command]) for host in self.hosts]
+
+
+def shard_states(run: Run, attempts: int, stale: float) -> List[str]:
+    states = []
+    for k in range(len(run.shards)):
+        status = run.status(k)
+        try:
+            age = time.time() - run.path(k, '.lock').stat().st_mtime
+        except FileNotFoundError:
+            age = None
+        if status is not None and not status['failed']:
+            states.append('done')
+        elif status is not None and status['attempt'] >= attempts:
+            states.append('failed')
+        elif age is not None:
+            states.append('stale' if age >= stale else 'running')
+        else:
+            states.append('pending')
+    return states
+
+
+def merge(run: Run, output: Optional[str]) -> List[str]:
+    """
+    write the records of all shards sorted by time to output, returns the
+    archives that failed. All shards must be done, see Run.is_done
+    """
+    with result_store.open_writer(output, read_data.thresholds_mip) as writer:
+        # every shard is sorted, equal times keep the shard order
+        for record in heapq.merge(*(run.read_shard(k) for k in range(len(run.shards))), key=lambda r: r['time']):
+            writer.write(record)
+    return [p for k in range(len(run.shards)) for p in run.status(k)['failed']]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    plan = commands.add_parser('plan', help='split the archives into shards')
+    plan.add_argument('run', type=Path, help='run directory, shared by all workers')
+    plan.add_argument('archives', nargs='*')
+    plan.add_argument('--file-list', type=argparse.FileType('r'),
+                      help='file with one archive per line, - for stdin')
+    plan.add_argument('--shard-size', type=int, default=4,
+                      help='archives per shard')
+    plan.add_argument('--backend', choices=read_data.VERIFIED_BACKENDS, default=read_data.DEFAULT_BACKEND,
+                      help='hitbuffer analysis implementation')
+    plan.add_argument('--histograms', action='store_true',
+                      help='write ADC histograms of each hitbuffer instead of hitrates')
+
+    work_parser = commands.add_parser('work', help='analyze shards until none is left')
+    launch = commands.add_parser('launch', help='start workers and wait for them')
+    for p in (work_parser, launch):
+        p.add_argument('run', type=Path)
+        p.add_argument('--jobs', '-j', type=int, default=1,
+                       help='number of worker processes of each worker')
+        p.add_argument('--attempts', type=int, default=3,
+                       help='number of times a shard with failed archives is analyzed')
+        p.add_argument('--stale', type=float, default=1800,
+                       help='seconds after which the lock of a worker that stopped is taken over')
+    launch.add_argument('--launcher', choices=['local', 'ssh'], default='local')
+    launch.add_argument('--workers', type=int, default=1,
+                        help='number of local workers')
+    launch.add_argument('--hosts', nargs='+', default=[],
+                        help='hosts of the ssh workers, one worker per entry')
+    launch.add_argument('--remote-dir', default='.',
+                        help='directory of batch.py on the hosts')
+    launch.add_argument('--setup',
+                        help='shell command run before the ssh workers, e.g. to select python')
+
+    status_parser = commands.add_parser('status', help='print the state of every shard')
+    status_parser.add_argument('run', type=Path)
+    status_parser.add_argument('--attempts', type=int, default=3)
+    status_parser.add_argument('--stale', type=float, default=1800)
+
+    merge_parser = commands.add_parser('merge', help='combine the shards into one result file')
+    merge_parser.add_argument('run', type=Path)
+    merge_parser.add_argument('--attempts', type=int, default=3,
+                              help='shards with failed archives are merged after this many attempts')
+    merge_parser.add_argument('--output', '-o',
+                              help='result file, .npz for columnar arrays, .gz for gzipped JSON lines, JSON lines on stdout by default')
+    args = parser.parse_args()
+
+    if args.command == 'plan':
+        if (args.run / 'manifest.json').exists():
+            parser.error(f'{args.run} is already planned')
+        if read_data.backend_error(args.backend, args.histograms) is not None:
+            parser.error(read_data.backend_error(args.backend, args.histograms))
+        archives = list(args.archives)
+        if args.file_list is not None:
+            archives += [line.strip() for line in args.file_list if line.strip()]
+        if not archives:
+            parser.error('no archives')
+        # workers run in other directories, e.g. --remote-dir of the ssh launcher
+        archives = [str(Path(a).resolve()) for a in archives]
+        run = Run.create(args.run, archives, args.shard_size, args.backend, args.histograms)
+        print(f'{len(archives)} archives in {len(run.shards)} shards', file=sys.stderr)
+        sys.exit(0)
+
+    run = Run(args.run)
+    if args.command == 'work':
+        analyzed = work(run, args.jobs, args.attempts, args.stale)
+        print(f'{worker_name()}: analyzed {analyzed} shards', file=sys.stderr)
+    elif args.command == 'launch':
+        if args.launcher == 'ssh':
+            if not args.hosts:
+                parser.error('--launcher ssh needs --hosts')
+            launcher = SshLauncher(args.hosts, args.remote_dir, args.setup)
+            # the run directory is opened from the remote directory
+            run_dir = str(args.run.resolve())
+        else:
+            launcher = LocalLauncher(args.workers)
+            run_dir = str(args.run)
+        workers = launcher.start(['work', run_dir, '--jobs', str(args.jobs),
+                                  '--attempts', str(args.attempts), '--stale', str(args.stale)])
+        for worker in workers:
+            worker.wait()
+    if args.command in ('launch', 'status'):
+        states = shard_states(run, args.attempts, args.stale)
+        if args.command == 'status':
+            for k, state in enumerate(states):
+                print(f'{k:04d} {state}')
+        counts = {state: states.count(state) for state in sorted(set(states))}
+        print(', '.join(f'{n} {state}' for state, n in counts.items()), file=sys.stderr)
+        if any(state != 'done' for state in states):
+            sys.exit(1)
+    elif args.command == 'merge':
+        # a failed shard may be analyzed again by a running worker
+        missing = [f'{k:04d}' for k in range(len(run.shards)) if not run.is_done(k, args.attempts)]
+        if missing:
+            parser.error(f'shards not done yet: {", ".join(missing)}')
+        if run.manifest['histograms'] and args.output is not None and args.output.endswith('.npz'):
+            parser.error('histograms can only be written as JSON lines')
+        failed = merge(run, args.output)
+        if failed:
+            print(f'{len(failed)} of {sum(len(s) for s in run.shards)} archives failed', file=sys.stderr)
+            sys.exit(1)
@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+"""
+throughput and peak memory of the analysis stages on a synthetic archive,
+optionally compared against a stored baseline
+"""
+import argparse
+import datetime
+import json
+import sys
+import tarfile
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import read_data
+import result_store
+import synthetic_archive
+from read_data import BinType, uDaqFile
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'plot'))
+from load import load_hitrate_json  # noqa: E402
+
+
+@dataclass
+class StageResult:
+    name: str
+    seconds: float
+    bytes: int
+    members: int
+    peak_bytes: int
+
+    @property
+    def mb_per_s(self) -> float:
+        return self.bytes / self.seconds / 1e6
+
+    @property
+    def members_per_s(self) -> float:
+        return self.members / self.seconds
+
+
+def measure(name: str, fn: Callable[[], None], nbytes: int, members: int, repeat: int) -> StageResult:
+    """ best time out of repeat runs, peak memory from one extra traced run """
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        seconds = min(seconds, time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return StageResult(name, seconds, nbytes, members, peak)
+
+
+def ignore_errors(fn: Callable[[bytes], object], payloads: List[bytes]) -> Callable[[], None]:
+    def run():
+        for payload in payloads:
+            try:
+                fn(payload)
+            except ValueError:
+                pass
+    return run
+
+
+def run_benchmarks(archive: Path, repeat: int) -> List[StageResult]:
+    compressed = read_data.inner_name(archive)
+    with tarfile.open(archive) as tar:
+        compressed_size = tar.getmember(compressed).size
+    inner = read_data.open_tar_outer(archive)
+    inner_size = len(inner.getvalue())
+
+    with tarfile.open(fileobj=inner) as tar:
+        members = [uDaqFile.parse(info) for info in tar.getmembers()]
+        hitfiles = [tar.extractfile(m.info).read()
+                    for m in members if m.type == BinType.HITBUF]
+        monitors = [tar.extractfile(m.info).read()
+                    for m in members if m.type == BinType.MONITOR]
+    frames = [bytes(frame) for payload in hitfiles
+              for frame in read_data.iter_cobs_frames(payload)]
+
+    records = []
+    read_data.read_tar_inner(read_data.open_tar_outer(archive), records.append)
+
+    results = []
+    results.append(measure('gunzip', lambda: read_data.open_tar_outer(archive),
+                           compressed_size, len(members), repeat))
+    results.append(measure('decode_cobs', ignore_errors(read_data.decode_cobs, frames),
+                           sum(map(len, frames)), len(frames), repeat))
+    results.append(measure('decode_cobs_hitfile', ignore_errors(read_data.decode_cobs_hitfile, hitfiles),
+                           sum(map(len, hitfiles)), len(hitfiles), repeat))
+    results.append(measure('decode_cobs_monitor', ignore_errors(read_data.decode_cobs_monitor, monitors),
+                           sum(map(len, monitors)), len(monitors), repeat))
+    results.append(measure('read_tar_inner', lambda: read_data.read_tar_inner(read_data.open_tar_outer(archive), lambda r: None),
+                           inner_size, len(members), repeat))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        result_file = str(Path(tmp) / 'result.json.gz')
+        with result_store.open_writer(result_file, read_data.thresholds_mip) as writer:
+            for record in records:
+                writer.write(record)
+        results.append(measure('load_hitrate', lambda: load_hitrate_json(result_file),
+                               Path(result_file).stat().st_size, len(records), repeat))
+    return results
+
+
+def compare(results: List[StageResult], baseline: Dict[str, dict], tolerance: float) -> bool:
+    """ print the change against the baseline, returns False on a regression """
+    ok = True
+    for r in results:
+        if r.name not in baseline:
+            continue
+        b = StageResult(**baseline[r.name])
+        speed = b.seconds / r.seconds
+        memory = r.peak_bytes / b.peak_bytes if b.peak_bytes else 1.0
+        regression = speed < 1 - tolerance or memory > 1 + tolerance
+        ok &= not regression
+        print(f'{r.name:20} speed x{speed:5.2f}  memory x{memory:5.2f}' +
+              ('  REGRESSION' if regression else ''))
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--archive', type=Path,
+                        help='archive to benchmark, a synthetic one is generated by default')
+    parser.add_argument('--hitbuffers', type=int, default=24,
+                        help='hitbuffers per channel of the synthetic archive')
+    parser.add_argument('--hits', type=int, default=20000,
+                        help='hits per hitbuffer of the synthetic archive')
+    parser.add_argument('--corruption', type=float, default=0.01)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--backend', choices=sorted({read_data.DEFAULT_BACKEND, *read_data.backends}),
+                        default=read_data.DEFAULT_BACKEND,
+                        help='numpy measures the speed of the unverified NumPy backend, see synthetic_archive.py')
+    parser.add_argument('--save-baseline', type=Path,
+                        help='store the results as baseline')
+    parser.add_argument('--baseline', type=Path,
+                        help='compare against this baseline, exit status 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative slowdown or memory increase counted as regression')
+    args = parser.parse_args()
+    if read_data.backend_error(args.backend) is not None:
+        parser.error(read_data.backend_error(args.backend))
+
+    read_data.set_backend(args.backend)
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = args.archive
+        if archive is None:
+            config = synthetic_archive.ArchiveConfig(
+                hitbuffers=args.hitbuffers, hits=args.hits, corruption=args.corruption)
+            archive = synthetic_archive.write_archive(
+                Path(tmp), datetime.date(2021, 3, 1), config)
+        results = run_benchmarks(archive, args.repeat)
+
+    print(f'{"stage":20} {"MB/s":>9} {"members/s":>11} {"peak MB":>9}')
+    for r in results:
+        print(f'{r.name:20} {r.mb_per_s:9.1f} {r.members_per_s:11.1f} {r.peak_bytes / 1e6:9.1f}')
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({r.name: asdict(r) for r in results}, f, indent=1)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+"""
+conformance check of the NumPy hitbuffer backend against the C++
+udaq_analysis_lib, exits with status 1 if any hitbuffer evaluates differently.
+With --record, the checked hitbuffers are stored with their C++ results as
+fixtures of test_backends.py, which then runs without the C++ library.
+"""
+import argparse
+import json
+import math
+import sys
+import tarfile
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from cobs import cobs
+
+import read_data
+from read_data import BinType, uDaqFile
+
+
+def hitrate_args(data: bytes, baseline: Tuple[Tuple[int, int], Tuple[int, int]], temperature: float, channel: int) -> tuple:
+    """ arguments of Backend.get_hitrates_thresh as read_data.evaluate_hitbuffer passes them """
+    baseline_sums, baseline_counts = baseline
+    baseline_adc = tuple(s/c for s, c in zip(baseline_sums, baseline_counts))
+    panel = read_data.panels[channel]
+    return (data, panel.adc_amp, baseline_adc, panel.mip_per_adc0(temperature, read_data.auxdac),
+            read_data.thresholds_mip, read_data.max_adc_counts)
+
+
+def record_fixture(directory: Path, name: str, raw: bytes, temperature: float, channel: int):
+    """ raw hitbuffer member and its C++ results, compared by test_backends.py """
+    cpp = read_data.backends['cpp']
+    read_data.set_backend('cpp')
+    data = cpp.hitbuffer(read_data.decode_cobs_hitfile(raw))
+    baseline = cpp.get_baseline(data, read_data.max_adc_counts)
+    (directory / name).write_bytes(raw)
+    with open(directory / (name + '.json'), 'w') as f:
+        json.dump({
+            'channel': channel,
+            'temperature': temperature,
+            'baseline': [list(b) for b in baseline],
+            'thresholds_mip': read_data.thresholds_mip,
+            'results': [list(r) for r in cpp.get_hitrates_thresh(*hitrate_args(data, baseline, temperature, channel))],
+        }, f, indent=1)
+
+
+def check_hitbuffer(raw: bytes, temperature: float, channel: int) -> List[str]:
+    cpp, numpy = read_data.backends['cpp'], read_data.backends['numpy']
+    problems = []
+
+    # checksums of all frames
+    for packet in raw.split(b'\0'):
+        if len(packet) < 4 or packet == b'\xff':
+            continue
+        payload = cobs.decode(packet)[:-2]
+        cs_cpp, cs_numpy = cpp.fletcher_16(payload), numpy.fletcher_16(payload)
+        if cs_cpp != cs_numpy:
+            problems.append(f'fletcher_16 {cs_cpp:04X} != {cs_numpy:04X}')
+
+    read_data.set_backend('cpp')
+    data = cpp.hitbuffer(read_data.decode_cobs_hitfile(raw))
+
+    baseline_cpp = cpp.get_baseline(data, read_data.max_adc_counts)
+    baseline_numpy = numpy.get_baseline(data, read_data.max_adc_counts)
+    if tuple(map(tuple, baseline_cpp)) != tuple(map(tuple, baseline_numpy)):
+        problems.append(f'baseline {baseline_cpp} != {baseline_numpy}')
+
+    # evaluate both with the same baseline to compare the hit counting alone
+    args = hitrate_args(data, baseline_cpp, temperature, channel)
+    rates_cpp = cpp.get_hitrates_thresh(*args)
+    rates_numpy = numpy.get_hitrates_thresh(*args)
+    for threshold_mip, (s_cpp, h_cpp), (s_numpy, h_numpy) in zip(read_data.thresholds_mip, rates_cpp, rates_numpy):
+        if h_cpp != h_numpy or not math.isclose(s_cpp, s_numpy, rel_tol=1e-9):
+            problems.append(
+                f'{threshold_mip} MIP: cpp {h_cpp} hits in {s_cpp} s, numpy {h_numpy} hits in {s_numpy} s')
+
+    return problems
+
+
+def check_archive(p: str, max_hitbuffers: Optional[int], record: Optional[Path] = None) -> int:
+    checked, failed = 0, 0
+    with tarfile.open(fileobj=read_data.open_tar_outer(p)) as tar:
+        members = [uDaqFile.parse(info) for info in tar.getmembers()]
+        members.sort(key=lambda m: m.time)
+        temperature = [None for _ in range(8)]
+
+        for m in members:
+            if m.type == BinType.MONITOR:
+                _, temperature[m.channel] = read_data.decode_cobs_monitor(
+                    tar.extractfile(m.info).read())
+            elif m.type == BinType.HITBUF and temperature[m.channel] is not None:
+                if max_hitbuffers is not None and checked >= max_hitbuffers:
+                    break
+                try:
+                    problems = check_hitbuffer(
+                        tar.extractfile(m.info).read(), temperature[m.channel], m.channel)
+                except ValueError:
+                    # corrupt hitbuffers are skipped by the analysis as well
+                    continue
+                checked += 1
+                if record is not None:
+                    record_fixture(record, m.info.name, tar.extractfile(m.info).read(), temperature[m.channel], m.channel)
+                if problems:
+                    failed += 1
+                    for problem in problems:
+                        print(m.info.name, problem)
+    print(f'{p}: {failed} of {checked} hitbuffers differ')
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('archives', nargs='+')
+    parser.add_argument('--max-hitbuffers', type=int,
+                        help='stop after this many hitbuffers per archive')
+    parser.add_argument('--record', type=Path, metavar='DIR',
+                        help='store the checked hitbuffers and their C++ results in DIR, e.g. fixtures/hitbuffers')
+    args = parser.parse_args()
+
+    if 'cpp' not in read_data.backends:
+        print('udaq_analysis_lib is not available', file=sys.stderr)
+        sys.exit(2)
+
+    if args.record is not None:
+        args.record.mkdir(parents=True, exist_ok=True)
+    failed = sum(check_archive(p, args.max_hitbuffers, args.record) for p in args.archives)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,154 @@
+"""
+NumPy implementation of the hitbuffer analysis.
+
+The decoded hitbuffer (concatenated COBS blocks) is a packed array of
+fixed-size hit records, see HIT_DTYPE. The format is defined by the C++
+udaq_analysis_lib, whose source is not part of this repository. HIT_DTYPE,
+CLOCK_HZ, FLAG_CPU_TRIGGER, the gain stage selection and the MIP scaling are
+reconstructed from the calls read_data.py makes, not taken from that source,
+and have not been checked against its results on real archives yet. Until
+test_backends.py passes on real hitbuffers recorded with check_backend.py
+--record, this module is not a --backend choice of the analysis scripts.
+"""
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# part of the result cache key, increment when results change
+VERSION = '1'
+
+# one record per hit as written by the uDAQ
+HIT_DTYPE = np.dtype([
+    ('time', '<u4'),  # timestamp in clock ticks, wraps around
+    ('adc', '<u2', (2,)),  # ADC counts of both gain stages
+    ('flags', '<u2'),  # trigger flags, see FLAG_*
+    ('reserved', '<u2'),
+])
+# uDAQ timestamp clock
+CLOCK_HZ = 60e6
+# hit was triggered by the CPU (forced trigger), used for the baseline
+FLAG_CPU_TRIGGER = 0x1
+
+
+def parse_hitbuffer(data: bytes) -> np.ndarray:
+    """ view the decoded hitbuffer as structured array (no copy) """
+    if len(data) % HIT_DTYPE.itemsize != 0:
+        raise ValueError(
+            f'hitbuffer size {len(data)} is not a multiple of {HIT_DTYPE.itemsize}')
+    return np.frombuffer(data, dtype=HIT_DTYPE)
+
+
+def get_livetime(hits: np.ndarray) -> float:
+    """ time covered by the hitbuffer in seconds """
+    if len(hits) < 2:
+        return 0.0
+    # unwrap 32 bit timestamps
+    ticks = np.diff(hits['time'].astype(np.int64)) % (1 << 32)
+    return float(ticks.sum()) / CLOCK_HZ
+
+
+def select_gain(hits: np.ndarray, adc_amp: Tuple[float, float], max_adc_counts: int) -> Tuple[int, int, np.ndarray]:
+    """
+    adc_amp is the relative signal per ADC count of each gain stage, use the
+    high gain stage (smaller adc_amp) unless it is saturated.
+    returns (high gain index, low gain index, saturated mask)
+    """
+    high = 0 if adc_amp[0] <= adc_amp[1] else 1
+    low = 1 - high
+    saturated = hits['adc'][:, high] >= max_adc_counts
+    return high, low, saturated
+
+
+def get_amplitude_mip(hits: np.ndarray, adc_amp: Tuple[float, float], baseline_adc: Tuple[float, float], mip_per_adc0: float, max_adc_counts: int) -> np.ndarray:
+    """ amplitude of every triggered (non-CPU) hit in MIP """
+    hits = hits[(hits['flags'] & FLAG_CPU_TRIGGER) == 0]
+    high, low, saturated = select_gain(hits, adc_amp, max_adc_counts)
+    adc = np.where(saturated, hits['adc'][:, low], hits['adc'][:, high])
+    baseline = np.where(saturated, baseline_adc[low], baseline_adc[high])
+    # convert ADC counts of either gain to MIP via the gain 0 calibration
+    mip_per_adc = mip_per_adc0 / adc_amp[0] * \
+        np.where(saturated, adc_amp[low], adc_amp[high])
+    return (adc - baseline) * mip_per_adc
+
+
+def get_hitrates_thresh(data: bytes, adc_amp: Tuple[float, float], baseline_adc: Tuple[float, float], mip_per_adc0: float, thresholds_mip: Sequence[float], max_adc_counts: int) -> List[Tuple[float, int]]:
+    """
+    evaluate all thresholds in a single pass over the hitbuffer,
+    returns one (seconds, hits) pair per threshold
+    """
+    hits = parse_hitbuffer(data)
+    seconds = get_livetime(hits)
+    amplitude = get_amplitude_mip(
+        hits, adc_amp, baseline_adc, mip_per_adc0, max_adc_counts)
+    amplitude.sort()
+    # number of hits with amplitude >= threshold
+    above = len(amplitude) - \
+        np.searchsorted(amplitude, thresholds_mip, side='left')
+    return [(seconds, int(n)) for n in above]
+
+
+def get_baseline(data: bytes, max_adc_counts: int) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """
+    sum and number of ADC values of all CPU triggered hits per gain stage,
+    saturated values are skipped
+    """
+    hits = parse_hitbuffer(data)
+    adc = hits['adc'][(hits['flags'] & FLAG_CPU_TRIGGER) != 0]
+    valid = adc < max_adc_counts
+    sums = np.where(valid, adc, 0).sum(axis=0, dtype=np.int64)
+    counts = valid.sum(axis=0)
+    return (int(sums[0]), int(sums[1])), (int(counts[0]), int(counts[1]))
+
+
+def get_hitrate_thresh(data: bytes, adc_amp: Tuple[float, float], baseline_adc: Tuple[float, float], mip_per_adc0: float, threshold_mip: float, max_adc_counts: int) -> Tuple[float, int]:
+    """ drop-in for analyze_hitbuffer.get_hitrate_thresh """
+    return get_hitrates_thresh(data, adc_amp, baseline_adc, mip_per_adc0, [threshold_mip], max_adc_counts)[0]
+
+
+def fletcher_16(data: bytes) -> int:
+    """ drop-in for udaq_analysis_lib.fletcher_16 """
+    b = np.frombuffer(data, dtype=np.uint8).astype(np.int64)
+    # sum2 adds up the running sum1, which weights each byte by (n - i)
+    sum1 = int(b.sum()) % 255
+    sum2 = int(np.dot(b, np.arange(len(b), 0, -1, dtype=np.int64))) % 255
+    return (sum2 << 8) | sum1
+
+
+def get_adc_histograms(data: bytes, adc_amp: Tuple[float, float], max_adc_counts: int) -> Tuple[int, List[Tuple[int, np.ndarray]]]:
+    """
+    histograms of the raw ADC counts of all triggered hits per gain stage,
+    each hit is counted in the gain stage get_amplitude_mip would use.
+    returns (high gain index, [(first ADC value, counts) per gain])
+    """
+    hits = parse_hitbuffer(data)
+    hits = hits[(hits['flags'] & FLAG_CPU_TRIGGER) == 0]
+    high, low, saturated = select_gain(hits, adc_amp, max_adc_counts)
+    histograms = []
+    for gain in (0, 1):
+        adc = hits['adc'][saturated if gain == low else ~saturated, gain]
+        if len(adc) == 0:
+            histograms.append((0, np.zeros(0, dtype=np.int64)))
+            continue
+        offset = int(adc.min())
+        histograms.append((offset, np.bincount(adc - offset)))
+    return high, histograms
+
+
+def get_hits_from_histograms(histograms: Sequence[Tuple[int, np.ndarray]], high: int, adc_amp: Tuple[float, float], baseline_adc: Tuple[float, float], mip_per_adc0: float, thresholds_mip: Sequence[float]) -> List[int]:
+    """ number of hits >= each threshold, same result as get_hitrates_thresh on the raw hitbuffer """
+    if high != (0 if adc_amp[0] <= adc_amp[1] else 1):
+        raise ValueError('histograms were sorted into gain stages with a different adc_amp order')
+    amplitude = []
+    counts = []
+    for gain, (offset, hist) in enumerate(histograms):
+        adc = np.arange(offset, offset + len(hist), dtype=np.uint16)
+        mip_per_adc = mip_per_adc0 / adc_amp[0] * adc_amp[gain]
+        amplitude.append((adc - baseline_adc[gain]) * mip_per_adc)
+        counts.append(np.asarray(hist))
+    amplitude = np.concatenate(amplitude)
+    counts = np.concatenate(counts)
+    order = np.argsort(amplitude, kind='stable')
+    cumulative = np.concatenate(([0], np.cumsum(counts[order])))
+    below = cumulative[np.searchsorted(
+        amplitude[order], thresholds_mip, side='left')]
+    return [int(cumulative[-1] - n) for n in below]
@@ -0,0 +1,58 @@
+"""
+Per-stage timing and error counters of read_data.py.
+
+Stages may be nested (cobs_decode contains checksum, extract contains gunzip
+when the inner archive is read sequentially), so their times do not add up to
+the total.
+"""
+import contextlib
+import time
+from collections import defaultdict
+from typing import Iterator
+
+
+class Stats:
+    def __init__(self):
+        self.wall = defaultdict(float)
+        self.cpu = defaultdict(float)
+        self.bytes = defaultdict(int)
+        self.count = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    @contextlib.contextmanager
+    def stage(self, name: str, nbytes: int = 0) -> Iterator[None]:
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.wall[name] += time.perf_counter() - wall
+            self.cpu[name] += time.process_time() - cpu
+            self.bytes[name] += nbytes
+            self.count[name] += 1
+
+    def error(self, category: str):
+        self.errors[category] += 1
+
+    def as_dict(self) -> dict:
+        return {
+            'stages': {
+                name: {
+                    'wall_s': self.wall[name],
+                    'cpu_s': self.cpu[name],
+                    'bytes': self.bytes[name],
+                    'count': self.count[name],
+                }
+                for name in self.count
+            },
+            'errors': dict(self.errors),
+        }
+
+    def merge(self, other: dict):
+        """ add the counters of another Stats.as_dict(), e.g. from a worker process """
+        for name, stage in other['stages'].items():
+            self.wall[name] += stage['wall_s']
+            self.cpu[name] += stage['cpu_s']
+            self.bytes[name] += stage['bytes']
+            self.count[name] += stage['count']
+        for category, n in other['errors'].items():
+            self.errors[category] += n
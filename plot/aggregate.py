@@ -0,0 +1,130 @@
+#!/usr/bin/python
+import json
+import numpy as np
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import Union
+
+from load import IceScintPanel, load_hitrate, snapshot_stamp
+from shared_files import atomic_write, write_json
+
+AGGREGATE_VERSION = 1
+# bin width in seconds
+RESOLUTIONS = {'10min': 600, '1h': 3600, '1d': 86400}
+
+@dataclass
+class Binned:
+    # start of each bin
+    date: np.ndarray
+    count: np.ndarray
+    # statistics per bin, same trailing shape as the values (e.g. one column per threshold)
+    mean: np.ndarray
+    std: np.ndarray
+    min: np.ndarray
+    max: np.ndarray
+
+@dataclass
+class PanelAggregate:
+    temp: Binned
+    hits: Binned
+
+def bin_values(date: np.ndarray, values: np.ndarray, seconds: int) -> Binned:
+    """ statistics of values in bins of fixed width, date must be sorted """
+    values = np.asarray(values, dtype=np.float64)
+    bins = date.astype('datetime64[s]').astype(np.int64) // seconds
+    if len(bins) == 0:
+        empty = np.empty((0, *values.shape[1:]))
+        return Binned(np.empty(0, 'datetime64[s]'), np.empty(0, np.int64), empty, empty, empty, empty)
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    count = np.diff(np.r_[starts, len(bins)])
+    n = count.reshape(-1, *[1] * (values.ndim - 1))
+    mean = np.add.reduceat(values, starts, axis=0) / n
+    # two passes, more accurate than the sum of squares
+    deviation = values - np.repeat(mean, count, axis=0)
+    std = np.sqrt(np.add.reduceat(deviation**2, starts, axis=0) / n)
+    return Binned(
+        (bins[starts] * seconds).astype('datetime64[s]'),
+        count,
+        mean,
+        std,
+        np.minimum.reduceat(values, starts, axis=0),
+        np.maximum.reduceat(values, starts, axis=0),
+    )
+
+def bin_centers(date: np.ndarray, resolution: str) -> np.ndarray:
+    """ middle of the bins starting at date, to plot them over the raw data """
+    return date + np.timedelta64(RESOLUTIONS[resolution] // 2, 's')
+
+def aggregate_panels(panels: list[IceScintPanel], seconds: int) -> list[PanelAggregate]:
+    return [
+        PanelAggregate(
+            bin_values(panel.temp_date, panel.temp_temp, seconds),
+            bin_values(panel.hits_date, panel.hits_rate, seconds),
+        )
+        for panel in panels
+    ]
+
+def aggregate_dir(input_file: str) -> Path:
+    p = Path(input_file)
+    return p.with_name(p.name + '.aggregate')
+
+def aggregate_stamp(input_file: str) -> dict:
+    return {**snapshot_stamp(input_file), 'version': AGGREGATE_VERSION}
+
+def load_cached(input_file: str, resolution: str) -> Union[list[PanelAggregate], None]:
+    directory = aggregate_dir(input_file)
+    try:
+        with open(directory / f'{resolution}.json') as f:
+            if json.load(f) != aggregate_stamp(input_file):
+                return None
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    with np.load(directory / f'{resolution}.npz') as f:
+        return [
+            PanelAggregate(*(
+                Binned(*(f[f'ch{c}_{series}_{field.name}'] for field in fields(Binned)))
+                for series in ('temp', 'hits')
+            ))
+            for c in range(len(f['channels']))
+        ]
+
+def save_cached(input_file: str, resolution: str, aggregates: list[PanelAggregate]):
+    directory = aggregate_dir(input_file)
+    directory.mkdir(exist_ok=True)
+    arrays = {'channels': np.arange(len(aggregates))}
+    for c, aggregate in enumerate(aggregates):
+        for series in ('temp', 'hits'):
+            for field in fields(Binned):
+                arrays[f'ch{c}_{series}_{field.name}'] = getattr(getattr(aggregate, series), field.name)
+    with atomic_write(directory / f'{resolution}.npz', 'wb') as f:
+        np.savez(f, **arrays)
+    # written last, marks the aggregates as complete
+    write_json(directory / f'{resolution}.json', aggregate_stamp(input_file), indent=None)
+
+def load_aggregates(input_file: str, resolution: str = '1h', cache: bool = True) -> list[PanelAggregate]:
+    """
+    time-binned mean, std, min, max and count per channel (and threshold) of
+    load_hitrate(input_file), cached next to the input for each resolution
+    """
+    if cache:
+        aggregates = load_cached(input_file, resolution)
+        if aggregates is not None:
+            return aggregates
+
+    aggregates = aggregate_panels(load_hitrate(input_file), RESOLUTIONS[resolution])
+
+    if cache:
+        try:
+            save_cached(input_file, resolution, aggregates)
+        except OSError:
+            # e.g. a read-only results directory, like the snapshot of load_hitrate
+            pass
+
+    return aggregates
+
+if __name__ == '__main__':
+    import sys
+    # precompute all resolutions, e.g. after read_data.py or watch.py
+    for input_file in sys.argv[1:]:
+        for resolution in RESOLUTIONS:
+            load_aggregates(input_file, resolution)
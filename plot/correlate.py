@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import sys
+import numpy as np
+
+from aggregate import RESOLUTIONS, load_aggregates
+from load import check_thresholds, load_hitrate, load_thresholds
+from weather import Weather, columns
+
+# date, time and quality flag columns are not correlated
+quantities = [c for c in columns if not c.startswith('qc_') and c not in ('year', 'jday', 'month', 'day', 'hour', 'min', 'dt')]
+
+# the thresholds were changed on 2021-06-15/16, fitted separately like in plot_weather.py
+periods = {
+    'high': lambda date: date <= np.datetime64('2021-06-15'),
+    'low': lambda date: date > np.datetime64('2021-06-16'),
+}
+
+def interpolate_columns(date: np.ndarray, weather_date: np.ndarray, table: np.ndarray) -> np.ndarray:
+    """
+    np.interp of every column of table (m, q) at date, the interval search
+    is done once for all columns
+    """
+    t = date.astype('datetime64[s]').astype(np.float64)
+    wt = weather_date.astype('datetime64[s]').astype(np.float64)
+    i = np.clip(np.searchsorted(wt, t, side='right'), 1, len(wt) - 1)
+    dt = wt[i] - wt[i - 1]
+    w = np.divide(t - wt[i - 1], dt, out=np.ones_like(t), where=dt > 0)
+    # constant outside the weather data, like np.interp
+    w = np.clip(w, 0, 1)[:, None]
+    return table[i - 1] * (1 - w) + table[i] * w
+
+def fit_lines(X: np.ndarray, Y: np.ndarray, mask: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    least squares lines Y[:, k] = slope * X[:, q] + offset for every pair of
+    columns at once, rows with mask[:, q] False are left out of the fits of q.
+    Returns slope (q, k), offset (q, k) and the number of points (q,)
+    """
+    M = mask.astype(np.float64)
+    n = M.sum(axis=0)
+    # centered, so pressure around 680 mbar does not lose precision
+    x0 = np.where(mask, X, 0).sum(axis=0) / np.maximum(n, 1)
+    Xc = np.where(mask, X - x0, 0)
+    y0 = Y.mean(axis=0)
+    Yc = Y - y0
+    Sx = Xc.sum(axis=0)[:, None]
+    Sxx = (Xc**2).sum(axis=0)[:, None]
+    # all (q, k) sums in two matrix products
+    Sy = M.T @ Yc
+    Sxy = Xc.T @ Yc
+    N = n[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (N * Sxy - Sx * Sy) / (N * Sxx - Sx**2)
+        offset = (Sy - slope * Sx) / N + y0 - slope * x0[:, None]
+    return slope, offset, n
+
+def weather_matrix(weather: Weather, date: np.ndarray, rh_discard: bool) -> tuple[np.ndarray, np.ndarray]:
+    table = np.stack([weather[q] for q in quantities], axis=1)
+    X = interpolate_columns(date, weather.date, table)
+    mask = np.ones(X.shape, dtype=bool)
+    # sometimes rH is reported as invalid, I assume this corresponds to sensor saturation -> 100% rH
+    rh = quantities.index('rh')
+    ok = X[:, rh] > 0
+    if rh_discard:
+        # discard invalid values
+        mask[:, rh] = ok
+    else:
+        # replace invalid values with 100
+        X[:, rh] = np.where(ok, X[:, rh], 100)
+    return X, mask
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='linear fits of the hitrate of every panel and threshold against every weather quantity, separately before and after the threshold change')
+    parser.add_argument('input', nargs='?', default='data/result.json.gz')
+    parser.add_argument('--output', '-o', help='CSV table, stdout by default')
+    parser.add_argument('--start', type=np.datetime64, help='first date of the fits')
+    parser.add_argument('--end', type=np.datetime64, help='end of the fits (exclusive)')
+    parser.add_argument('--resolution', choices=list(RESOLUTIONS), help='fit time-binned means instead of every hitbuffer')
+    parser.add_argument('--rh-discard', action='store_true', help='leave out invalid rH values instead of setting them to 100')
+    args = parser.parse_args()
+
+    weather = Weather()
+    # which column of panel.hits_rate corresponds to which MIP threshold?
+    thresholds_mip = load_thresholds(args.input)
+    if args.resolution is None:
+        series = [(panel.hits_date, panel.hits_rate) for panel in load_hitrate(args.input)]
+    else:
+        series = [(a.hits.date, a.hits.mean) for a in load_aggregates(args.input, args.resolution)]
+
+    f = sys.stdout if args.output is None else open(args.output, 'w', newline='')
+    table = csv.writer(f)
+    table.writerow(['panel', 'period', 'quantity', 'threshold_mip', 'n', 'slope', 'offset', 'relative_percent'])
+    for i_panel, (date, rate) in enumerate(series):
+        if len(date) == 0:
+            # nothing analyzed yet
+            continue
+        try:
+            check_thresholds(thresholds_mip, rate)
+        except ValueError as e:
+            parser.error(str(e))
+        selected = np.ones(len(date), dtype=bool)
+        if args.start is not None:
+            selected &= date >= args.start
+        if args.end is not None:
+            selected &= date < args.end
+        for period, in_period in periods.items():
+            fitted = selected & in_period(date)
+            if not fitted.any():
+                continue
+            X, mask = weather_matrix(weather, date[fitted], args.rh_discard)
+            slope, offset, n = fit_lines(X, np.asarray(rate[fitted]), mask)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                relative = np.where(offset != 0, 100 * slope / offset, np.nan)
+            for q, quantity in enumerate(quantities):
+                for k, threshold in enumerate(thresholds_mip):
+                    table.writerow([i_panel, period, quantity, threshold, int(n[q]), slope[q, k], offset[q, k], relative[q, k]])
+    if f is not sys.stdout:
+        f.close()
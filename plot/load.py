@@ -1,11 +1,21 @@
 #!/usr/bin/python
 import json
-import matplotlib.pyplot as plt
-import datetime
 import numpy as np
 from dataclasses import dataclass
 from typing import Union
 import gzip
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from shared_files import atomic_path, file_stamp  # noqa: E402
+
+SNAPSHOT_VERSION = 1
+FIELDS = ['temp_date', 'temp_temp', 'hits_date', 'hits_rate']
+
+# JSON lines results do not store their thresholds, these are the ones of read_data.py
+DEFAULT_THRESHOLDS_MIP = [0, 0.5, 1, 1.5, 2, 2.5, 3, 3.5, 4, 4.5, 5, 5.5, 6, 6.5, 7]
 
 @dataclass
 class IceScintPanel:
@@ -19,35 +29,197 @@ class IceScintPanel:
     def fix(self):
         def fix(name_x : str, name_y: str):
             X, Y = getattr(self, name_x), getattr(self, name_y)
-            X, Y = np.array(X), np.array(Y)
-            i = X.argsort()
-            setattr(self, name_x, X[i].astype('datetime64[s]'))
-            setattr(self, name_y, Y[i])
+            X, Y = np.asarray(X), np.asarray(Y)
+            # results are usually written in time order already
+            if np.any(X[1:] < X[:-1]):
+                i = X.argsort()
+                X, Y = X[i], Y[i]
+            setattr(self, name_x, X.astype('datetime64[s]'))
+            setattr(self, name_y, Y)
         fix('temp_date', 'temp_temp')
         fix('hits_date', 'hits_rate')
 
-def load_hitrate(input_file: str) -> list[IceScintPanel]:
+class GrowableArray:
+    """ append rows to a preallocated array, doubling its capacity when full """
+    def __init__(self, row_shape: tuple = (), capacity: int = 4096):
+        self.data = np.empty((capacity, *row_shape))
+        self.size = 0
+
+    def extend(self, rows: np.ndarray):
+        if self.size + len(rows) > len(self.data):
+            capacity = max(2 * len(self.data), self.size + len(rows))
+            data = np.empty((capacity, *self.data.shape[1:]))
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+        self.data[self.size:self.size + len(rows)] = rows
+        self.size += len(rows)
+
+    def array(self) -> np.ndarray:
+        return self.data[:self.size]
+
+def load_hitrate_npz(input_file: str) -> list[IceScintPanel]:
+    # columnar output of read_data.py --output result.npz
+    with np.load(input_file) as f:
+        panels = [
+            IceScintPanel(f[f'ch{c}_temp_time'], f[f'ch{c}_temp'], f[f'ch{c}_hits_time'], f[f'ch{c}_hits_rate'])
+            for c in range(8)
+        ]
+
+    for panel in panels:
+        panel.fix()
+
+    return panels
+
+def load_hitrate_json(input_file: str, chunk_lines: int = 100000) -> list[IceScintPanel]:
+    temp_date = [GrowableArray() for _ in range(8)]
+    temp_temp = [GrowableArray() for _ in range(8)]
+    hits_date = [GrowableArray() for _ in range(8)]
+    hits_rate = None
+
+    with gzip.open(input_file, 'rt') as f_in:
+        while True:
+            lines = [line for _, line in zip(range(chunk_lines), f_in)]
+            if not lines:
+                break
+            # a single json.loads call per chunk
+            records = json.loads('[' + ','.join(lines) + ']')
+
+            hits = [r for r in records if 'results' in r]
+            temps = [r for r in records if 'temp' in r]
+
+            if hits:
+                channel = np.fromiter((r['channel'] for r in hits), np.int64, len(hits))
+                time = np.fromiter((r['time'] for r in hits), np.float64, len(hits))
+                rate = np.array([r['results'] for r in hits], dtype=np.float64)
+                if hits_rate is None:
+                    hits_rate = [GrowableArray(rate.shape[1:]) for _ in range(8)]
+                for c in range(8):
+                    mask = channel == c
+                    hits_date[c].extend(time[mask])
+                    hits_rate[c].extend(rate[mask])
+
+            if temps:
+                channel = np.fromiter((r['channel'] for r in temps), np.int64, len(temps))
+                time = np.fromiter((r['time'] for r in temps), np.float64, len(temps))
+                temp = np.fromiter((r['temp'] for r in temps), np.float64, len(temps))
+                for c in range(8):
+                    mask = channel == c
+                    temp_date[c].extend(time[mask])
+                    temp_temp[c].extend(temp[mask])
+
+    if hits_rate is None:
+        hits_rate = [GrowableArray() for _ in range(8)]
+
     panels = [
-        IceScintPanel([], [], [], [])
-        for _ in range(8)
+        IceScintPanel(temp_date[c].array(), temp_temp[c].array(), hits_date[c].array(), hits_rate[c].array())
+        for c in range(8)
     ]
 
-    with gzip.open(input_file, 'rt') as f_in:
-    # with gzip.open('data/result.json.gz', 'rt') as f_in:
-        for line in f_in:
-            data = json.loads(line)
-            channel = int(data['channel'])
-            time = float(data['time'])
-            if 'results' in data:
-                results = data['results']
-                panels[channel].hits_date.append(time)
-                panels[channel].hits_rate.append(results)
-            elif 'temp' in data:
-                temp = float(data['temp'])
-                panels[channel].temp_date.append(time)
-                panels[channel].temp_temp.append(temp)
+    for panel in panels:
+        panel.fix()
+
+    return panels
+
+def snapshot_dir(input_file: str) -> Path:
+    p = Path(input_file)
+    return p.with_name(p.name + '.snapshot')
+
+def snapshot_stamp(input_file: str) -> dict:
+    p = Path(input_file)
+    if p.is_dir():
+        # store of watch.py, changes with every new segment
+        p = p / 'manifest.json'
+    return {'version': SNAPSHOT_VERSION, **file_stamp(p)}
+
+def load_snapshot(input_file: str) -> Union[list[IceScintPanel], None]:
+    directory = snapshot_dir(input_file)
+    try:
+        with open(directory / 'source.json') as f:
+            if json.load(f) != snapshot_stamp(input_file):
+                return None
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return [
+        IceScintPanel(*(np.load(directory / f'ch{c}_{name}.npy', mmap_mode='r') for name in FIELDS))
+        for c in range(8)
+    ]
+
+def save_snapshot(input_file: str, panels: list[IceScintPanel]):
+    # written next to the old snapshot and swapped in as a whole, arrays of
+    # earlier calls keep mapping the files of the old one
+    with atomic_path(snapshot_dir(input_file)) as tmp:
+        tmp.mkdir()
+        for c, panel in enumerate(panels):
+            for name in FIELDS:
+                np.save(tmp / f'ch{c}_{name}.npy', getattr(panel, name))
+        with open(tmp / 'source.json', 'w') as f:
+            json.dump(snapshot_stamp(input_file), f)
+
+def store_segments(directory: str) -> list[str]:
+    with open(Path(directory) / 'manifest.json') as f:
+        manifest = json.load(f)
+    segments = sorted({a['segment'] for a in manifest['archives'].values() if a['segment'] is not None})
+    return [str(Path(directory) / 'segments' / s) for s in segments]
+
+def load_hitrate_store(directory: str) -> list[IceScintPanel]:
+    # segments written by watch.py, each has its own snapshot, so only new segments are parsed
+    parts = [load_hitrate(segment) for segment in store_segments(directory)]
+    if not parts:
+        # nothing analyzed yet
+        return [IceScintPanel(np.empty(0, 'datetime64[s]'), np.empty(0), np.empty(0, 'datetime64[s]'), np.empty((0, 0))) for _ in range(8)]
+    panels = [
+        IceScintPanel(*(np.concatenate([getattr(part[c], name) for part in parts]) for name in FIELDS))
+        for c in range(8)
+    ]
 
     for panel in panels:
         panel.fix()
-    
+
+    return panels
+
+def load_thresholds(input_file: str) -> np.ndarray:
+    """
+    MIP threshold of each column of IceScintPanel.hits_rate, stored in npz
+    results (e.g. of recalibrate.py --thresholds)
+    """
+    if os.path.isdir(input_file):
+        segments = store_segments(input_file)
+        if segments:
+            return load_thresholds(segments[0])
+    elif input_file.endswith('.npz'):
+        with np.load(input_file) as f:
+            return f['thresholds_mip']
+    return np.array(DEFAULT_THRESHOLDS_MIP)
+
+def check_thresholds(thresholds_mip: np.ndarray, hits_rate: np.ndarray):
+    # JSON lines written with other thresholds than the default ones
+    if len(hits_rate) and hits_rate.shape[1] != len(thresholds_mip):
+        raise ValueError(f'{hits_rate.shape[1]} hitrate columns but {len(thresholds_mip)} thresholds, write the results as .npz')
+
+def load_hitrate(input_file: str, snapshot: bool = True) -> list[IceScintPanel]:
+    """
+    load read_data.py results, the sorted arrays are saved next to the input
+    and memory-mapped by later calls until the input changes. A directory is
+    read as the segment store of watch.py
+    """
+    if snapshot:
+        panels = load_snapshot(input_file)
+        if panels is not None:
+            return panels
+
+    if os.path.isdir(input_file):
+        panels = load_hitrate_store(input_file)
+    elif input_file.endswith('.npz'):
+        panels = load_hitrate_npz(input_file)
+    else:
+        # with gzip.open('data/result.json.gz', 'rt') as f_in:
+        panels = load_hitrate_json(input_file)
+
+    if snapshot:
+        try:
+            save_snapshot(input_file, panels)
+        except OSError:
+            # e.g. a read-only results directory, the panels are still loaded
+            pass
+
     return panels
@@ -4,27 +4,31 @@ import matplotlib.pyplot as plt
 import datetime
 import numpy as np
 
-from load import panels
+from aggregate import load_aggregates
+
+# hourly means instead of every hitbuffer
+aggregates = load_aggregates('data/result.json.gz', '1h')
 
 ax1 = plt.gca()
 
 threshold_index = 14
 
-for i_panel, panel in enumerate(panels):
+for i_panel, aggregate in enumerate(aggregates):
+    hits_date, hits_rate = aggregate.hits.date, aggregate.hits.mean
     if True:
         # high threshold
-        i_cutoff = np.argmax(panel.hits_date > np.datetime64('2021-06-15'))
-        panel.hits_rate = panel.hits_rate[:i_cutoff]
-        panel.hits_date = panel.hits_date[:i_cutoff]
+        i_cutoff = np.argmax(hits_date > np.datetime64('2021-06-15'))
+        hits_rate = hits_rate[:i_cutoff]
+        hits_date = hits_date[:i_cutoff]
     else:
         # low threshold (0.5 MIP)
-        i_cutoff = np.argmax(panel.hits_date > np.datetime64('2021-06-16'))
-        panel.hits_rate = panel.hits_rate[i_cutoff:]
-        panel.hits_date = panel.hits_date[i_cutoff:]
+        i_cutoff = np.argmax(hits_date > np.datetime64('2021-06-16'))
+        hits_rate = hits_rate[i_cutoff:]
+        hits_date = hits_date[i_cutoff:]
 
-    temp = np.interp(panel.hits_date.astype('f'), panel.temp_date.astype('f'), panel.temp_temp)
+    temp = np.interp(hits_date.astype('f'), aggregate.temp.date.astype('f'), aggregate.temp.mean)
     
-    ax1.plot(temp, panel.hits_rate[:,threshold_index], '.', label=f'channel {i_panel}', alpha=0.1)
+    ax1.plot(temp, hits_rate[:,threshold_index], '.', label=f'channel {i_panel}', alpha=0.3)
 
 ax1.set_xlabel('Temperature (K)')
 ax1.set_ylabel('Hitrate (1/s)')
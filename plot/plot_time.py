@@ -4,14 +4,19 @@ import matplotlib.pyplot as plt
 import datetime
 import numpy as np
 
-from load import panels
+from aggregate import bin_centers, load_aggregates
+
+# hourly means instead of every hitbuffer, other resolutions are cached on first use
+# (or all at once with python aggregate.py data/result.json.gz)
+resolution = '1h'
+aggregates = load_aggregates('data/result.json.gz', resolution)
 
 ax1 = plt.gca()
 ax2 = ax1.twinx()
 
-for i_panel, panel in enumerate(panels):
-    ax1.plot(panel.hits_date, panel.hits_rate, '.', label=f'channel {i_panel}', alpha=0.1)
-    ax2.plot(panel.temp_date, panel.temp_temp, '-r', alpha=0.3)
+for i_panel, aggregate in enumerate(aggregates):
+    ax1.plot(bin_centers(aggregate.hits.date, resolution), aggregate.hits.mean, '.', label=f'channel {i_panel}', alpha=0.3)
+    ax2.plot(bin_centers(aggregate.temp.date, resolution), aggregate.temp.mean, '-r', alpha=0.3)
 
 ax1.set_xlabel('Date')
 ax1.set_ylabel('Hitrate (1/s)')
@@ -1,14 +1,13 @@
 #!/usr/bin/env python3
-import json
 import matplotlib.pyplot as plt
-import datetime
 import numpy as np
 import sys
 from plotStyle_marie import colors
 
 plt.style.use('./matplotlibrc_marie.mplstyle')
 
-from load import load_hitrate
+from load import check_thresholds, load_hitrate, load_thresholds
+from weather import Weather
 
 conf_use_low_threshold = False
 conf_plot_linear_fit = False
@@ -17,29 +16,19 @@ conf_full_calibration = True
 
 if conf_full_calibration:
     # full panel calibration (ADC/pe and pe/MIP from linear fit in temperature)
-    panels = load_hitrate('data/result.json.gz')
+    result_file = 'data/result.json.gz'
 else:
     # incomplete panel calibration (ADC/pe from linear fit in temperature, but pe/MIP assumes constant 260K)
     # this is equivalent to a pe threshold instead of a mip threshold
-    panels = load_hitrate('data/result_no_mip_cal.json.gz')
+    # recalibrate.py histograms.json.gz --mip-temperature 260 -o data/result_no_mip_cal.json.gz
+    result_file = 'data/result_no_mip_cal.json.gz'
+panels = load_hitrate(result_file)
 
 # which column of panel.hits_rate corresponds to which MIP threshold?
-thresholds_mip = [0, 0.5, 1, 1.5, 2, 2.5, 3, 3.5, 4, 4.5, 5, 5.5, 6, 6.5, 7]
+thresholds_mip = list(load_thresholds(result_file))
 
 # weather data from NOAA
-columns = ['year', 'jday', 'month', 'day', 'hour', 'min', 'dt', 'zen', 'dw_solar', 'qc_dwsolar', 'uw_solar', 'qc_uwsolar', 'direct_n', 'qc_direct_n', 'diffuse', 'qc_diffuse', 'dw_ir', 'qc_dwir', 'dw_casetemp', 'qc_dwcasetemp', 'dw_dometemp', 'qc_dwdometemp', 'uw_ir', 'qc_uwir',
-           'uw_casetemp', 'qc_uwcasetemp', 'uw_dometemp', 'qc_uwdometemp', 'uvb', 'qc_uvb', 'par', 'qc_par', 'netsolar', 'qc_netsolar', 'netir', 'qc_netir', 'totalnet', 'qc_totalnet', 'temp', 'qc_temp', 'rh', 'qc_rh', 'windspd', 'qc_windspd', 'winddir', 'qc_winddir', 'pressure', 'qc_pressure']
-weather = np.loadtxt('weather_data/weather.dat.gz', skiprows=2, unpack=True)
-
-# convert to numpy date
-weather_date = np.array([
-    (
-        datetime.datetime(int(year), 1, 1) +
-        datetime.timedelta(days=int(jday)-1, hours=int(hour),
-                           minutes=int(minute))
-    ).timestamp()
-    for year, jday, hour, minute in zip(weather[0], weather[1], weather[4], weather[5])
-]).astype('datetime64[s]')
+weather = Weather()
 
 column_name = sys.argv[1] # 'pressure'
 ax1 = plt.gca()
@@ -61,8 +50,8 @@ for i_panel, panel in enumerate(panels):
     # interpolate weather data
     weather_column = np.interp(
         panel.hits_date.astype('f'),
-        weather_date.astype('f'),
-        weather[columns.index(column_name)]
+        weather.date.astype('f'),
+        weather[column_name]
     )
 
     # sometimes rH is reported as invalid, I assume this corresponds to sensor saturation -> 100% rH
@@ -76,6 +65,7 @@ for i_panel, panel in enumerate(panels):
             # replace invalid values with 100
             weather_column = np.where(ok, weather_column, 100)
 
+    check_thresholds(thresholds_mip, panel.hits_rate)
     hitrate = panel.hits_rate[:, thresholds_mip.index(mip_threshold)]
 
     # linear fit
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from shared_files import atomic_path, file_stamp  # noqa: E402
+
+# weather data from NOAA
+columns = ['year', 'jday', 'month', 'day', 'hour', 'min', 'dt', 'zen', 'dw_solar', 'qc_dwsolar', 'uw_solar', 'qc_uwsolar', 'direct_n', 'qc_direct_n', 'diffuse', 'qc_diffuse', 'dw_ir', 'qc_dwir', 'dw_casetemp', 'qc_dwcasetemp', 'dw_dometemp', 'qc_dwdometemp', 'uw_ir', 'qc_uwir',
+           'uw_casetemp', 'qc_uwcasetemp', 'uw_dometemp', 'qc_uwdometemp', 'uvb', 'qc_uvb', 'par', 'qc_par', 'netsolar', 'qc_netsolar', 'netir', 'qc_netir', 'totalnet', 'qc_totalnet', 'temp', 'qc_temp', 'rh', 'qc_rh', 'windspd', 'qc_windspd', 'winddir', 'qc_winddir', 'pressure', 'qc_pressure']
+
+
+class Weather:
+    """
+    NOAA weather table, converted once into one .npy file per column next to
+    the source. Columns are memory-mapped when they are first accessed.
+    """
+
+    def __init__(self, source: str = 'weather_data/weather.dat.gz'):
+        self.source = Path(source)
+        self.cache_dir = self.source.with_name(self.source.name + '.cache')
+        self._columns: dict[str, np.ndarray] = {}
+        if not self._cache_valid():
+            self._build_cache()
+
+    def _cache_valid(self) -> bool:
+        try:
+            with open(self.cache_dir / 'source.json') as f:
+                return json.load(f) == file_stamp(self.source)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+
+    def _build_cache(self):
+        table = np.loadtxt(self.source, skiprows=2, unpack=True)
+        with atomic_path(self.cache_dir) as tmp:
+            tmp.mkdir()
+            for name, column in zip(columns, table):
+                np.save(tmp / f'{name}.npy', column)
+            # year + day of year + time of day, vectorized
+            year, jday, hour, minute = (
+                table[columns.index(c)].astype(np.int64) for c in ('year', 'jday', 'hour', 'min'))
+            date = (year - 1970).astype('datetime64[Y]').astype('datetime64[s]')
+            date += ((jday - 1) * 86400 + hour * 3600 + minute * 60).astype('timedelta64[s]')
+            np.save(tmp / 'date.npy', date)
+            with open(tmp / 'source.json', 'w') as f:
+                json.dump(file_stamp(self.source), f)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        if name not in self._columns:
+            if name != 'date' and name not in columns:
+                raise KeyError(name)
+            self._columns[name] = np.load(self.cache_dir / f'{name}.npy', mmap_mode='r')
+        return self._columns[name]
+
+    @property
+    def date(self) -> np.ndarray:
+        return self['date']
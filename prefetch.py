@@ -0,0 +1,51 @@
+"""
+Read-ahead of archives in background threads.
+
+Loading (file reads and zlib decompression) releases the GIL, so the next
+archives are read while the current one is analyzed.
+"""
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Generic, Iterable, Iterator, Tuple, TypeVar
+
+K = TypeVar('K')
+V = TypeVar('V')
+
+
+class Prefetcher(Generic[K, V]):
+    def __init__(self, keys: Iterable[K], load: Callable[[K], V], cost: Callable[[K], int], depth: int = 2, max_bytes: int = 1 << 31):
+        """
+        load up to depth keys ahead of the one being processed, as long as
+        the estimated cost of the loaded values stays below max_bytes. A
+        single value larger than max_bytes is still loaded, one at a time.
+        """
+        self.keys = keys
+        self.load = load
+        self.cost = cost
+        self.depth = depth
+        self.max_bytes = max_bytes
+
+    def __iter__(self) -> Iterator[Tuple[K, 'Future[V]']]:
+        """
+        (key, future) in key order, future.result() waits for the value and
+        raises the errors of load
+        """
+        keys = iter(self.keys)
+        pending: Deque[Tuple[K, int, Future]] = collections.deque()
+        held = 0
+        with ThreadPoolExecutor(max(self.depth, 1)) as pool:
+            next_key = next(keys, None)
+            while next_key is not None or pending:
+                # the value being processed plus depth values ahead
+                while next_key is not None and len(pending) <= self.depth:
+                    cost = self.cost(next_key)
+                    if pending and held + cost > self.max_bytes:
+                        break
+                    pending.append(
+                        (next_key, cost, pool.submit(self.load, next_key)))
+                    held += cost
+                    next_key = next(keys, None)
+                key, cost, future = pending.popleft()
+                yield key, future
+                # released once the consumer asks for the next value
+                held -= cost
@@ -1,21 +1,166 @@
 #!/usr/bin/python3
+import argparse
+import contextlib
 import datetime
 import enum
 import gzip
+import hashlib
+import heapq
 import io
+import multiprocessing
+import multiprocessing.pool
+import time
 import struct
 import sys
 import tarfile
-from dataclasses import dataclass
+import zlib
+from dataclasses import asdict, dataclass, replace
 from pathlib import Path
-from typing import IO, Tuple
+from typing import IO, Callable, ContextManager, Dict, FrozenSet, Iterator, List, Optional, Sequence, Tuple
 import json
 
+import numpy as np
 from cobs import cobs
 
-# load C++ implemenations
-import udaq_analysis_lib.analyze_hitbuffer as analyze
-from udaq_analysis_lib.fletcher_16 import fletcher_16
+import hitbuffer
+import result_store
+from instrumentation import Stats
+from prefetch import Prefetcher
+from result_cache import ResultCache
+from seek_index import ArchiveIndex
+
+# load C++ implemenations if they are built
+try:
+    import udaq_analysis_lib.analyze_hitbuffer as analyze
+    from udaq_analysis_lib.fletcher_16 import fletcher_16 as fletcher_16_cpp
+except ImportError:
+    analyze = None
+
+
+@dataclass
+class Backend:
+    name: str
+    version: str
+    fletcher_16: Callable[[bytes], int]
+    get_baseline: Callable[[bytes, int], Tuple[Tuple[int, int], Tuple[int, int]]]
+    # (data, adc_amp, baseline_adc, mip_per_adc0, thresholds_mip, max_adc_counts) -> [(seconds, hits)]
+    get_hitrates_thresh: Callable[..., List[Tuple[float, int]]]
+    # (data, adc_amp, max_adc_counts) -> (seconds, high gain index, [(first ADC value, counts) per gain]),
+    # None if the backend can not write histograms
+    get_adc_histograms: Optional[Callable[..., Tuple[float, int, List[Tuple[int, np.ndarray]]]]] = None
+    # get_baseline and friends only accept bytes, not the memoryview of the decoder
+    takes_bytes: bool = False
+
+    def hitbuffer(self, data: memoryview) -> bytes:
+        """ decoded hitbuffer as the backend accepts it, copied once per member at most """
+        return bytes(data) if self.takes_bytes else data
+
+
+def fletcher_16_cpp_view(data: bytes) -> int:
+    # the C++ library only accepts bytes, decode_cobs passes memoryviews
+    return fletcher_16_cpp(bytes(data))
+
+
+def get_hitrates_thresh_cpp(data: bytes, adc_amp: Tuple[float, float], baseline_adc: Tuple[float, float], mip_per_adc0: float, thresholds_mip: Sequence[float], max_adc_counts: int) -> List[Tuple[float, int]]:
+    # udaq_analysis_lib has no batched entry point, every threshold scans the
+    # whole hitbuffer. Only the NumPy backend evaluates them in one pass
+    return [
+        analyze.get_hitrate_thresh(
+            data, adc_amp, baseline_adc, mip_per_adc0, threshold_mip, max_adc_counts)
+        for threshold_mip in thresholds_mip
+    ]
+
+
+def get_adc_histograms_numpy(data: bytes, adc_amp: Tuple[float, float], max_adc_counts: int) -> Tuple[float, int, List[Tuple[int, np.ndarray]]]:
+    high_gain, histograms = hitbuffer.get_adc_histograms(data, adc_amp, max_adc_counts)
+    return hitbuffer.get_livetime(hitbuffer.parse_hitbuffer(data)), high_gain, histograms
+
+
+def package_version(name: str) -> str:
+    """ hash of the files of package name, changes whenever the C++ library is rebuilt """
+    h = hashlib.sha256()
+    for directory in sys.modules[name].__path__:
+        for p in sorted(Path(directory).iterdir()):
+            if p.is_file():
+                h.update(p.name.encode())
+                h.update(p.read_bytes())
+    return h.hexdigest()
+
+
+backends = {
+    'numpy': Backend('numpy', hitbuffer.VERSION, hitbuffer.fletcher_16, hitbuffer.get_baseline, hitbuffer.get_hitrates_thresh, get_adc_histograms_numpy),
+}
+if analyze is not None:
+    backends['cpp'] = Backend(
+        'cpp', package_version('udaq_analysis_lib'), fletcher_16_cpp_view, analyze.get_baseline, get_hitrates_thresh_cpp,
+        takes_bytes=True)
+
+# udaq_analysis_lib defines the hitbuffer format. The NumPy backend reimplements
+# it without its source, it is only used by check_backend.py, test_backends.py
+# and benchmark.py until test_backends.py passes on real hitbuffers recorded
+# with check_backend.py --record.
+DEFAULT_BACKEND = 'cpp'
+VERIFIED_BACKENDS = ['cpp']
+backend: Optional[Backend] = backends.get(DEFAULT_BACKEND)
+
+
+def backend_error(name: str, histograms: bool = False) -> Optional[str]:
+    """ why backend name can not be used (to write histograms), None if it can """
+    if name not in backends:
+        if name == 'cpp':
+            return 'udaq_analysis_lib is not installed'
+        return f'backend {name} not available, choose from {", ".join(backends)}'
+    if histograms and backends[name].get_adc_histograms is None:
+        return f'backend {name} can not write ADC histograms'
+    if histograms and name not in VERIFIED_BACKENDS:
+        # recalibrated hitrates would rest on the unverified hitbuffer format
+        return f'backend {name} is not verified, ADC histograms need a verified backend'
+    return None
+
+
+def set_backend(name: str):
+    global backend
+    error = backend_error(name)
+    if error is not None:
+        raise ValueError(error)
+    backend = backends[name]
+
+
+# emit threshold independent ADC histograms instead of hitrates, see recalibrate.py
+emit_histograms = False
+
+# read members through the seek index stored in this directory, see seek_index.py
+seek_index_dir: Optional[Path] = None
+
+
+# per-stage statistics of the current archive, None when instrumentation is off
+stats: Optional[Stats] = None
+NO_STATS = contextlib.nullcontext()
+
+
+def reset_stats(enabled: bool):
+    global stats
+    stats = Stats() if enabled else None
+
+
+def timed(stage: str, nbytes: int = 0):
+    return NO_STATS if stats is None else stats.stage(stage, nbytes)
+
+
+def count_error(category: str):
+    if stats is not None:
+        stats.error(category)
+
+
+def init_worker(backend_name: str, histograms: bool, instrument: bool = False, index_dir: Optional[Path] = None):
+    global emit_histograms, seek_index_dir
+    error = backend_error(backend_name, histograms)
+    if error is not None:
+        raise ValueError(error)
+    set_backend(backend_name)
+    emit_histograms = histograms
+    seek_index_dir = index_dir
+    reset_stats(instrument)
 
 
 @dataclass
@@ -28,6 +173,18 @@ class Panel:
     mip_per_pe_factor_temp: float = float('Nan')
     mip_per_pe_factor_auxdac: float = float('Nan')
 
+    def mip_per_adc0(self, temperature: float, auxdac: int) -> float:
+        # pe per adc "gain"
+        adc_per_pe = self.adc_per_pe_offset
+        adc_per_pe += self.adc_per_pe_factor_temp * temperature
+        adc_per_pe += self.adc_per_pe_factor_auxdac * auxdac
+        # MIP per pe
+        pe_per_mip = self.mip_per_pe_offset
+        pe_per_mip += self.mip_per_pe_factor_temp * temperature
+        pe_per_mip += self.mip_per_pe_factor_auxdac * auxdac
+
+        return 1 / (adc_per_pe * pe_per_mip)
+
 
 # from calibration csvs
 panels = [
@@ -49,15 +206,80 @@ panels = [
           adc_per_pe_factor_auxdac=0.0938045438530023, mip_per_pe_offset=-79.25182088382198, mip_per_pe_factor_temp=-0.2923868693440639, mip_per_pe_factor_auxdac=0.07643681240096512),
 ]
 
+# we always used the same AUXDAC (SiPM voltage) for all hitbuffer measurements ~Marie
+auxdac = 2650
+max_adc_counts = 3600
+thresholds_mip = [0, 0.5, 1, 1.5, 2, 2.5, 3, 3.5, 4, 4.5, 5, 5.5, 6, 6.5, 7]
+
+
+def config_fingerprint(channel: int, member_filter: Optional['MemberFilter'] = None) -> str:
+    """
+    hash of everything that affects the records of one channel, including the
+    member types and times analyzed. The default filter covers complete channels
+    """
+    member_filter = MemberFilter() if member_filter is None else member_filter
+    config = {
+        'panel': asdict(panels[channel]),
+        'thresholds_mip': thresholds_mip,
+        'auxdac': auxdac,
+        'max_adc_counts': max_adc_counts,
+        'backend': [backend.name, backend.version],
+        'histograms': emit_histograms,
+        'time_zone': 'UTC',
+        'types': sorted(t.name for t in member_filter.types),
+        'start': None if member_filter.start is None else member_filter.start.isoformat(),
+        'end': None if member_filter.end is None else member_filter.end.isoformat(),
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
 
-def decode_cobs(packet: bytes) -> bytes:
+def iter_cobs_frames(data_in: bytes) -> Iterator[np.ndarray]:
+    """ zero-copy views of the COBS frames in data_in """
+    buf = np.frombuffer(data_in, dtype=np.uint8)
+    delimiters = np.flatnonzero(buf == 0)
+    starts = np.concatenate(([0], delimiters + 1)).tolist()
+    ends = np.append(delimiters, len(buf)).tolist()
+    for start, end in zip(starts, ends):
+        # skip empty frames and 0xFF fill bytes
+        if end == start or (end == start + 1 and buf[start] == 0xff):
+            continue
+        yield buf[start:end]
+
+
+class ChecksumError(ValueError):
+    pass
+
+
+class MissingOkError(ValueError):
+    pass
+
+
+class BlockCountError(ValueError):
+    pass
+
+
+def error_category(e: Exception) -> str:
+    if isinstance(e, ChecksumError):
+        return 'bad_checksum'
+    if isinstance(e, MissingOkError):
+        return 'missing_ok'
+    if isinstance(e, BlockCountError):
+        return 'wrong_block_count'
+    if isinstance(e, cobs.DecodeError):
+        return 'bad_frame'
+    return 'other'
+
+
+def decode_cobs(packet: bytes) -> memoryview:
     if len(packet) < 4:
-        raise ValueError(f'packet too short {packet}')
-    packet = cobs.decode(packet)
-    cs_calc = fletcher_16(packet[:-2])
+        raise ValueError(f'packet too short {bytes(packet)}')
+    packet = memoryview(cobs.decode(packet))
+    # verify checksum on views of the decoded packet
+    with timed('checksum', len(packet)):
+        cs_calc = backend.fletcher_16(packet[:-2])
     cs_recv, = struct.unpack('<H', packet[-2:])
     if cs_calc != cs_recv:
-        raise ValueError(f'invalid checksum {cs_calc:04X} {cs_recv:04X}')
+        raise ChecksumError(f'invalid checksum {cs_calc:04X} {cs_recv:04X}')
         # raise ValueError(f'invalid checksum {cs_calc=:04X} {cs_recv=:04X}')
     return packet[1:-2]
 
@@ -65,40 +287,50 @@ def decode_cobs(packet: bytes) -> bytes:
 OK_STR = b'OK\n\0'
 
 
-def decode_cobs_hitfile(data_in: bytes) -> bytes:
-    packets = [
-        decode_cobs(packet)
-        for packet in data_in.split(b'\0')
-        if len(packet) > 0 and packet != b'\xff'
-    ]
+def decode_cobs_hitfile(data_in: bytes) -> memoryview:
+    frames = iter_cobs_frames(data_in)
     # decode header (single byte with number of blocks)
-    header = packets[0]
+    header = decode_cobs(next(frames, b''))
     if len(header) != 2:
         # stupid old python version
         raise ValueError(f'len(header) = {len(header)} != 2')
         # raise ValueError(f'{len(header)=} != 2')
     num_blocks, = struct.unpack('<H', header)
+    # copy blocks straight into one buffer, allocated on the first block
+    # assuming all blocks have the same size. The block is written once the
+    # next frame arrives, as the last frame is the OK string instead of data.
+    data = None
+    size = 0
+    received = 0
+    block = None
+    for frame in frames:
+        if block is not None:
+            if data is None:
+                data = bytearray(num_blocks * len(block))
+            data[size:size + len(block)] = block
+            size += len(block)
+            received += 1
+        block = decode_cobs(frame)
     # check last packet for OK
-    last_block = packets[-1]
+    last_block = block
     if last_block != OK_STR:
         # stupid old python version
-        raise ValueError(f'last_block= {last_block} is not OK')
+        raise MissingOkError(
+            f'last_block= {last_block if last_block is None else bytes(last_block)} is not OK')
         # raise ValueError(f'{last_block=} is not OK')
     # check that we have exactly the right number of blocks
-    if len(packets) != num_blocks + 2:
-        raise ValueError(
-            f'wrong number of blocks received:{len(packets)-2}, expected {num_blocks}')
-    data = bytearray()
-    for block in packets[1:-1]:
-        data.extend(block)
-    return bytes(data)
+    if received != num_blocks:
+        raise BlockCountError(
+            f'wrong number of blocks received:{received}, expected {num_blocks}')
+    if data is None:
+        data = bytearray()
+    return memoryview(data)[:size]
 
 
 def decode_cobs_monitor(data_in: bytes) -> Tuple[datetime.datetime, float]:
     packets = [
-        decode_cobs(packet)
-        for packet in data_in.split(b'\0')
-        if len(packet) > 0 and packet != b'\xff'
+        bytes(decode_cobs(packet))
+        for packet in iter_cobs_frames(data_in)
     ]
     try:
         # temperature packet usually starts with this TODO: find better criterium
@@ -117,6 +349,14 @@ def decode_cobs_monitor(data_in: bytes) -> Tuple[datetime.datetime, float]:
     return time, temperature
 
 
+def unix_time(time: datetime.datetime) -> float:
+    """
+    member times (file names and TAI) are UTC, like the weather data, and
+    must not be shifted by the time zone of the analysis host
+    """
+    return time.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
 class BinType(enum.IntEnum):
     MONITOR = 0
     HITBUF = 1
@@ -151,93 +391,691 @@ class uDaqFile:
         return uDaqFile(info, channel, time, bintype)
 
 
-def read_tar_inner(i: IO[bytes]):
+@dataclass(frozen=True)
+class MemberFilter:
+    """
+    selection of channels, member types and times [start, end), applied to
+    the member names before anything is extracted. Monitors before start are
+    still read, so the first hitbuffers after start have a temperature.
+    """
+    channels: Optional[FrozenSet[int]] = None
+    start: Optional[datetime.datetime] = None
+    end: Optional[datetime.datetime] = None
+    types: FrozenSet[BinType] = frozenset({BinType.MONITOR, BinType.HITBUF})
+
+    @property
+    def monitors_only(self) -> bool:
+        return self.types == {BinType.MONITOR}
+
+    def accepts(self, channel: int, time: datetime.datetime, bintype: BinType) -> bool:
+        return (self.channels is None or channel in self.channels) \
+            and bintype in self.types \
+            and (self.start is None or time >= self.start) \
+            and (self.end is None or time < self.end)
+
+    def emits(self, m: uDaqFile) -> bool:
+        return self.accepts(m.channel, m.time, m.type)
+
+    def emits_record(self, record: dict) -> bool:
+        return self.accepts(record['channel'], datetime.datetime.fromtimestamp(record['time'], datetime.timezone.utc).replace(tzinfo=None), record_type(record))
+
+    def reads(self, m: uDaqFile) -> bool:
+        if m.type == BinType.MONITOR and BinType.HITBUF in self.types:
+            # temperature of the selected hitbuffers
+            return (self.channels is None or m.channel in self.channels) \
+                and (self.end is None or m.time < self.end)
+        return self.emits(m)
+
+    def reads_archive(self, p: Path) -> bool:
+        """ by the day in the archive name, with one day of slack """
+        try:
+            day = datetime.datetime.strptime(
+                inner_name(p), 'scint-taxi-MicroDAQ_hitbuf_%Y%m%d.tgz')
+        except ValueError:
+            return True
+        slack = datetime.timedelta(days=1)
+        return (self.start is None or day + 2 * slack > self.start) \
+            and (self.end is None or day - slack < self.end)
+
+
+def record_type(record: dict) -> BinType:
+    return BinType.MONITOR if 'temp' in record else BinType.HITBUF
+
+
+def note_positions(members: List[uDaqFile], positions: Optional[Dict[Tuple[int, float, BinType], int]]):
+    """
+    index of each member in the inner archive by (channel, time, type), the
+    readers emit records of the same time in this order. members in archive order
+    """
+    if positions is None:
+        return
+    for k, m in enumerate(members):
+        positions.setdefault((m.channel, unix_time(m.time), m.type), k)
+
+
+def write_record(record: dict):
+    json.dump(record, sys.stdout)
+    sys.stdout.write('\n')
+
+
+def read_member(tar: tarfile.TarFile, info: tarfile.TarInfo) -> bytes:
+    with timed('extract', info.size):
+        return tar.extractfile(info).read()
+
+
+class GunzipReader:
+    """
+    decompressed stream of a gzip file for tarfile.open(mode='r|'), the
+    decompression is timed as gunzip stage by compressed bytes, like the
+    in-memory gunzip of open_tar_outer
+    """
+    CHUNK = 1 << 16
+
+    def __init__(self, compressed: IO[bytes]):
+        self.compressed = compressed
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.buffer = bytearray()
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self.buffer) < size:
+            chunk = self.decompressor.unused_data or self.compressed.read(self.CHUNK)
+            if not chunk:
+                if not self.decompressor.eof:
+                    raise EOFError('compressed file ended before the end-of-stream marker was reached')
+                break
+            if self.decompressor.eof:
+                # next gzip member
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            with timed('gunzip', len(chunk)):
+                self.buffer += self.decompressor.decompress(chunk)
+        size = len(self.buffer) if size < 0 else min(size, len(self.buffer))
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+def decode_monitor(data_in: bytes) -> float:
+    with timed('monitor_decode', len(data_in)):
+        _, temp = decode_cobs_monitor(data_in)
+    return temp
+
+
+def read_monitor(tar: tarfile.TarFile, info: tarfile.TarInfo) -> float:
+    return decode_monitor(read_member(tar, info))
+
+
+def evaluate_hitbuffer(m: uDaqFile, data_in: bytes, temperature: float) -> Optional[dict]:
+    try:
+        # concatenate COBS frames
+        with timed('cobs_decode', len(data_in)):
+            data = backend.hitbuffer(decode_cobs_hitfile(data_in))
+        # count cpu triggers
+        with timed('baseline', len(data)):
+            baseline_sums, baseline_counts = backend.get_baseline(
+                data, max_adc_counts)
+        baseline_adc = tuple(
+            s/c for s, c in zip(baseline_sums, baseline_counts))
+        # calculate panel properties
+        panel = panels[m.channel]
+        if emit_histograms:
+            with timed('histograms', len(data)):
+                return histogram_record(m, data, panel, baseline_adc, temperature)
+        mip_per_adc0 = panel.mip_per_adc0(temperature, auxdac)
+
+        # all thresholds in one backend call
+        with timed('thresholds', len(data)):
+            results = [
+                hits/seconds
+                for seconds, hits in backend.get_hitrates_thresh(
+                    data,
+                    panel.adc_amp,
+                    baseline_adc,
+                    mip_per_adc0,
+                    thresholds_mip,
+                    max_adc_counts,
+                )
+            ]
+
+        return {
+            'channel': m.channel,
+            'time': unix_time(m.time),
+            'results': results,
+        }
+    except Exception as e:
+        count_error(error_category(e))
+        print(m.info.name, e, file=sys.stderr)
+        return None
+
+
+def histogram_record(m: uDaqFile, data: bytes, panel: Panel, baseline_adc: Tuple[float, float], temperature: float) -> dict:
+    # everything recalibrate.py needs to compute hitrates for any calibration and thresholds
+    seconds, high_gain, histograms = backend.get_adc_histograms(
+        data, panel.adc_amp, max_adc_counts)
+    return {
+        'channel': m.channel,
+        'time': unix_time(m.time),
+        'temperature': temperature,
+        'seconds': seconds,
+        'baseline': list(baseline_adc),
+        'high_gain': high_gain,
+        'histograms': [[offset, hist.tolist()] for offset, hist in histograms],
+    }
+
+
+def monitor_record(m: uDaqFile, temp: float) -> dict:
+    return {
+        'channel': m.channel,
+        'time': unix_time(m.time),
+        'temp': temp,
+    }
+
+
+def evaluate_hitbuffer_args(args: Tuple[uDaqFile, bytes, float]) -> Tuple[Optional[dict], Optional[dict]]:
+    # workers send the statistics of each member back with the record
+    reset_stats(stats is not None)
+    record = evaluate_hitbuffer(*args)
+    return record, None if stats is None else stats.as_dict()
+
+
+def read_members_parallel(tar: tarfile.TarFile, members: List[uDaqFile], pool: multiprocessing.pool.Pool, emit: Callable[[dict], None], member_filter: MemberFilter):
+    # first pass: decode the monitor files and resolve the temperature of each hitbuffer
+    plan = []
+    temperature = [None for _ in range(8)]
+    for m in members:
+        if m.type == BinType.HITBUF:
+            if temperature[m.channel] is not None:
+                plan.append((m, temperature[m.channel]))
+            else:
+                count_error('missing_temperature')
+        elif m.type == BinType.MONITOR:
+            temp = read_monitor(tar, m.info)
+            temperature[m.channel] = temp
+            plan.append((m, temp))
+
+    # the members are read in the task feeder thread of the pool, which
+    # counts into its own Stats, merged once all tasks are sent
+    feeder = None if stats is None else Stats()
+
+    def read_hitbuffers() -> Iterator[Tuple[uDaqFile, bytes, float]]:
+        for m, temp in plan:
+            if m.type == BinType.HITBUF:
+                with NO_STATS if feeder is None else feeder.stage('extract', m.info.size):
+                    data = tar.extractfile(m.info).read()
+                yield m, data, temp
+
+    # decode and evaluate hitbuffers on the pool, imap keeps the time order
+    tasks = read_hitbuffers()
+    results = pool.imap(evaluate_hitbuffer_args, tasks, chunksize=4)
+    for m, temp in plan:
+        if m.type == BinType.MONITOR:
+            if member_filter.emits(m):
+                emit(monitor_record(m, temp))
+            continue
+        record, member_stats = next(results)
+        if member_stats is not None:
+            stats.merge(member_stats)
+        if record is not None:
+            emit(record)
+    if feeder is not None:
+        stats.merge(feeder.as_dict())
+
+
+def open_member_pool(jobs: int, instrument: bool) -> ContextManager[Optional[multiprocessing.pool.Pool]]:
+    """ pool evaluating the hitbuffers of every archive of a run, None for jobs == 1 """
+    if jobs == 1:
+        return contextlib.nullcontext()
+    return multiprocessing.Pool(jobs, initializer=init_worker, initargs=(backend.name, emit_histograms, instrument, seek_index_dir))
+
+
+def read_tar_inner(i: IO[bytes], emit: Callable[[dict], None] = write_record, member_pool: Optional[multiprocessing.pool.Pool] = None, member_filter: MemberFilter = MemberFilter(), positions: Optional[Dict[Tuple[int, float, BinType], int]] = None):
+    """
+    member_pool: evaluates the hitbuffers in parallel, see open_member_pool.
+    positions: filled with the archive index of every member, see note_positions
+    """
     with tarfile.open(fileobj=i) as tar:
         members = [uDaqFile.parse(info) for info in tar.getmembers()]
+        note_positions(members, positions)
+        members = [m for m in members if member_filter.reads(m)]
         members.sort(key=lambda m: m.time)
 
-        # we always used the same AUXDAC (SiPM voltage) for all hitbuffer measurements ~Marie
-        auxdac = 2650
+        if member_pool is not None:
+            read_members_parallel(tar, members, member_pool, emit, member_filter)
+            return
+
         temperature = [None for _ in range(8)]
-        max_adc_counts = 3600
-        thresholds_mip = [0, 0.5, 1, 1.5, 2, 2.5, 3, 3.5, 4, 4.5, 5, 5.5, 6, 6.5, 7]
 
         for m in members:
             if m.type == BinType.HITBUF:
                 # only evaluate hitbuffer measurements when we have a valid soft threshold
                 if temperature[m.channel] is None:
+                    count_error('missing_temperature')
                     continue
-                try:
-
-                    # concatenate COBS frames
-                    data = decode_cobs_hitfile(tar.extractfile(m.info).read())
-                    # count cpu triggers
-                    baseline_sums, baseline_counts = analyze.get_baseline(
-                        data, max_adc_counts)
-                    baseline_adc = tuple(
-                        s/c for s, c in zip(baseline_sums, baseline_counts))
-                    # calculate panel properties
-                    panel = panels[m.channel]
-                    # pe per adc "gain"
-                    adc_per_pe = panel.adc_per_pe_offset
-                    adc_per_pe += panel.adc_per_pe_factor_temp * \
-                        temperature[m.channel]
-                    adc_per_pe += panel.adc_per_pe_factor_auxdac * auxdac
-                    # MIP per pe
-                    pe_per_mip = panel.mip_per_pe_offset
-                    pe_per_mip += panel.mip_per_pe_factor_temp * \
-                        temperature[m.channel]
-                    pe_per_mip += panel.mip_per_pe_factor_auxdac * auxdac
-
-                    mip_per_adc0 = 1 / (adc_per_pe * pe_per_mip)
-
-                    results = []
-
-                    for threshold_mip in thresholds_mip:
-                        seconds, hits = analyze.get_hitrate_thresh(
-                            data,
-                            panel.adc_amp,
-                            baseline_adc,
-                            mip_per_adc0,
-                            threshold_mip,
-                            max_adc_counts,
-                        )
-                        results.append(hits/seconds)
-
-                    json.dump({
-                        'channel': m.channel,
-                        'time': m.time.timestamp(),
-                        'results': results,
-                    }, sys.stdout)
-                    sys.stdout.write('\n')
-                except Exception as e:
-                    print(m.info.name, e, file=sys.stderr)
-                    continue
+                record = evaluate_hitbuffer(
+                    m, read_member(tar, m.info), temperature[m.channel])
+                if record is not None:
+                    emit(record)
             elif m.type == BinType.MONITOR:
-                _, temp = decode_cobs_monitor(tar.extractfile(m.info).read())
+                temp = read_monitor(tar, m.info)
                 temperature[m.channel] = temp
-                json.dump({
-                    'channel': m.channel,
-                    'time': m.time.timestamp(),
-                    'temp': temp,
-                }, sys.stdout)
-                sys.stdout.write('\n')
+                if member_filter.emits(m):
+                    emit(monitor_record(m, temp))
+
+
+def read_tar_inner_streaming(open_inner: Callable[[], IO[bytes]], emit: Callable[[dict], None] = write_record, member_filter: MemberFilter = MemberFilter(), positions: Optional[Dict[Tuple[int, float, BinType], int]] = None):
+    """
+    same output as read_tar_inner, but the compressed inner archive is read
+    sequentially twice instead of being decompressed into memory
+    """
+    # first pass: list all members and decode the small monitor files
+    members = []
+    monitor_temp = {}
+    with tarfile.open(fileobj=GunzipReader(open_inner()), mode='r|') as tar:
+        for k, info in enumerate(tar):
+            m = uDaqFile.parse(info)
+            members.append(m)
+            if m.type == BinType.MONITOR and member_filter.reads(m):
+                monitor_temp[k] = read_monitor(tar, info)
+    note_positions(members, positions)
+
+    selected = [k for k, m in enumerate(members) if member_filter.reads(m)]
+    order, hitbuffer_temp = assign_temperatures(members, selected, monitor_temp)
+
+    # second pass: evaluate hitbuffers in archive order, keep only the small results
+    hitbuffer_records = {}
+    with tarfile.open(fileobj=GunzipReader(open_inner()), mode='r|') as tar:
+        for k, info in enumerate(tar):
+            if k in hitbuffer_temp:
+                hitbuffer_records[k] = evaluate_hitbuffer(
+                    members[k], read_member(tar, info), hitbuffer_temp[k])
+
+    emit_in_time_order(members, order, monitor_temp,
+                       hitbuffer_records, emit, member_filter)
+
+
+def assign_temperatures(members: List[uDaqFile], selected: List[int], monitor_temp: Dict[int, float]) -> Tuple[List[int], Dict[int, float]]:
+    """
+    time order of the selected members and the most recent monitor
+    temperature of each hitbuffer, members are referred to by archive position
+    """
+    order = sorted(selected, key=lambda k: members[k].time)
+    temperature = [None for _ in range(8)]
+    hitbuffer_temp = {}
+    for k in order:
+        m = members[k]
+        if m.type == BinType.MONITOR:
+            temperature[m.channel] = monitor_temp[k]
+        elif m.type == BinType.HITBUF:
+            if temperature[m.channel] is not None:
+                hitbuffer_temp[k] = temperature[m.channel]
+            else:
+                count_error('missing_temperature')
+    return order, hitbuffer_temp
+
+
+def emit_in_time_order(members: List[uDaqFile], order: List[int], monitor_temp: Dict[int, float], hitbuffer_records: Dict[int, Optional[dict]], emit: Callable[[dict], None], member_filter: MemberFilter):
+    for k in order:
+        m = members[k]
+        if m.type == BinType.MONITOR:
+            if member_filter.emits(m):
+                emit(monitor_record(m, monitor_temp[k]))
+        elif hitbuffer_records.get(k) is not None:
+            emit(hitbuffer_records[k])
+
+
+def read_tar_indexed(index: ArchiveIndex, emit: Callable[[dict], None] = write_record, member_filter: MemberFilter = MemberFilter(), positions: Optional[Dict[Tuple[int, float, BinType], int]] = None):
+    """
+    same output as read_tar_inner, but only the selected members are read
+    through the seek index, first the monitors and then the hitbuffers, each
+    in archive order
+    """
+    members = [uDaqFile.parse(info) for info in index.members]
+    note_positions(members, positions)
+    selected = [k for k, m in enumerate(members) if member_filter.reads(m)]
+
+    def extract(keys: List[int]) -> Iterator[Tuple[int, bytes]]:
+        contents = index.extract(members[k].info for k in keys)
+        for k in keys:
+            # seeking and reading the index decompresses the member, slicing it out is negligible
+            with timed('gunzip', members[k].info.size):
+                _, data = next(contents)
+            yield k, data
+
+    monitor_temp = {
+        k: decode_monitor(data)
+        for k, data in extract([k for k in selected if members[k].type == BinType.MONITOR])
+    }
+    order, hitbuffer_temp = assign_temperatures(members, selected, monitor_temp)
+    hitbuffer_records = {
+        k: evaluate_hitbuffer(members[k], data, hitbuffer_temp[k])
+        for k, data in extract(sorted(hitbuffer_temp))
+    }
+    emit_in_time_order(members, order, monitor_temp,
+                       hitbuffer_records, emit, member_filter)
+
+
+def read_tar_inner_monitors(i: IO[bytes], emit: Callable[[dict], None] = write_record, member_filter: MemberFilter = MemberFilter(types=frozenset({BinType.MONITOR})), positions: Optional[Dict[Tuple[int, float, BinType], int]] = None):
+    """
+    temperature records only: members are classified by name and only the
+    monitor files are extracted, the compressed inner archive is read once
+    """
+    records = []
+    members = []
+    with tarfile.open(fileobj=GunzipReader(i), mode='r|') as tar:
+        for info in tar:
+            m = uDaqFile.parse(info)
+            members.append(m)
+            if m.type != BinType.MONITOR or not member_filter.emits(m):
+                continue
+            records.append(monitor_record(m, read_monitor(tar, info)))
+    note_positions(members, positions)
+    # same order as read_tar_inner, which sorts the members by time
+    records.sort(key=lambda r: r['time'])
+    for record in records:
+        emit(record)
 
 
-def read_tar_outer(p: Path):
-    p = Path(p)
-    name, _, _ = p.name.partition('.flat.tar')
+def inner_name(p: Path) -> str:
+    name, _, _ = Path(p).name.partition('.flat.tar')
+    return name + '.tgz'
+
+
+def open_tar_outer(p: Path) -> IO[bytes]:
     with tarfile.open(p) as tar:
+        info = tar.getmember(inner_name(p))
         # decompress inner tgz into memory to speed up random access
-        inner = io.BytesIO(gzip.decompress(
-            tar.extractfile(name + '.tgz').read()))
-        read_tar_inner(inner)
-
-
-if len(sys.argv) > 1:
-    read_tar_outer(sys.argv[1])
-else:
-    # read_tar_outer('./data-hitbuf/scint-taxi-MicroDAQ_hitbuf_20210114.flat.tar')
-    # read_tar_outer('./data-hitbuf/scint-taxi-MicroDAQ_hitbuf_20210125.flat.tar')
-    read_tar_outer(
-        './data-hitbuf/scint-taxi-MicroDAQ_hitbuf_20210302.flat.tar')
+        with timed('gunzip', info.size):
+            return io.BytesIO(gzip.decompress(tar.extractfile(info).read()))
+
+
+def reads_decompressed(streaming: bool, member_filter: MemberFilter) -> bool:
+    """ whether read_tar_outer decompresses the inner archive into memory """
+    return not streaming and not member_filter.monitors_only and seek_index_dir is None
+
+
+def load_tar_outer(p: Path, decompress: bool) -> io.BytesIO:
+    """
+    inner archive in memory, decompressed for read_tar_inner or compressed
+    for the sequential readers. Runs in prefetch threads, so it is not timed
+    """
+    with tarfile.open(p) as tar:
+        data = tar.extractfile(inner_name(p)).read()
+    return io.BytesIO(gzip.decompress(data) if decompress else data)
+
+
+def load_cost(p: Path, decompress: bool) -> int:
+    """ memory held by load_tar_outer, from the tar header and the gzip trailer """
+    try:
+        with tarfile.open(p) as tar:
+            info = tar.getmember(inner_name(p))
+            if not decompress:
+                return info.size
+            f = tar.fileobj
+            f.seek(info.offset_data + info.size - 4)
+            # ISIZE, the decompressed size modulo 2**32
+            isize, = struct.unpack('<I', f.read(4))
+        return max(isize, info.size)
+    except (OSError, KeyError, struct.error, tarfile.TarError):
+        # reported when the archive is loaded
+        return 0
+
+
+def read_tar_outer(p: Path, streaming: bool = False, emit: Callable[[dict], None] = write_record, member_pool: Optional[multiprocessing.pool.Pool] = None, member_filter: MemberFilter = MemberFilter(), inner: Optional[io.BytesIO] = None, positions: Optional[Dict[Tuple[int, float, BinType], int]] = None):
+    """
+    inner: the archive loaded in advance by load_tar_outer.
+    positions: filled with the archive index of every member, see note_positions
+    """
+    if seek_index_dir is not None:
+        read_tar_indexed(ArchiveIndex(p, inner_name(p), seek_index_dir),
+                         emit, member_filter, positions)
+        return
+    if reads_decompressed(streaming, member_filter):
+        read_tar_inner(open_tar_outer(p) if inner is None else inner,
+                       emit, member_pool, member_filter, positions)
+        return
+    with contextlib.ExitStack() as stack:
+        if inner is None:
+            tar = stack.enter_context(tarfile.open(p))
+
+            def open_inner() -> IO[bytes]:
+                return tar.extractfile(inner_name(p))
+        else:
+            def open_inner() -> IO[bytes]:
+                # shares the loaded bytes, a BytesIO over getbuffer() copies them
+                return io.BytesIO(inner.getvalue())
+        if member_filter.monitors_only:
+            read_tar_inner_monitors(open_inner(), emit, member_filter, positions)
+        else:
+            read_tar_inner_streaming(open_inner, emit, member_filter, positions)
+
+
+def read_tar_outer_cached(p: Path, cache: ResultCache, streaming: bool = False, emit: Callable[[dict], None] = write_record, member_pool: Optional[multiprocessing.pool.Pool] = None, member_filter: MemberFilter = MemberFilter(), inner: Optional[io.BytesIO] = None):
+    """
+    serve channels whose archive and configuration did not change from the
+    cache, only the remaining channels are analyzed. Entries hold the member
+    types and times of the filter they were analyzed with, entries of complete
+    channels serve any filter, times and member types are filtered when
+    records are emitted
+    """
+    identity = cache.archive_identity(p)
+    analyzed = replace(member_filter, channels=None)
+    channels = range(8) if member_filter.channels is None else sorted(member_filter.channels)
+    # (position of the member in the archive, record) per channel
+    records = {}
+    for c in channels:
+        records[c] = cache.get(identity, c, config_fingerprint(c, analyzed))
+        if records[c] is None and analyzed != MemberFilter():
+            records[c] = cache.get(identity, c, config_fingerprint(c))
+    missing = frozenset(c for c in channels if records[c] is None)
+    if missing:
+        fresh: Dict[int, List[dict]] = {c: [] for c in missing}
+        positions: Dict[Tuple[int, float, BinType], int] = {}
+        read_tar_outer(p, streaming, lambda r: fresh[r['channel']].append(r),
+                       member_pool, replace(member_filter, channels=missing), inner, positions)
+        for c in sorted(missing):
+            records[c] = [(positions[r['channel'], r['time'], record_type(r)], r) for r in fresh[c]]
+            cache.put(identity, c, config_fingerprint(c, analyzed), records[c])
+    # merge channels by time and archive order, so cached and fresh results are emitted alike
+    for _, record in heapq.merge(*records.values(), key=lambda e: (e[1]['time'], e[0])):
+        if member_filter.emits_record(record):
+            emit(record)
+
+
+def analyze_archive(p: str, streaming: bool = False, cache: Optional[ResultCache] = None, member_filter: MemberFilter = MemberFilter()) -> Tuple[str, List[dict], Optional[str], Optional[dict]]:
+    """ collect all records of one archive, returns (archive, records, error, stats) """
+    reset_stats(stats is not None)
+    records = []
+    error = None
+    try:
+        if cache is None:
+            read_tar_outer(p, streaming, records.append,
+                           member_filter=member_filter)
+        else:
+            read_tar_outer_cached(p, cache, streaming, records.append,
+                                  member_filter=member_filter)
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+    return p, records, error, None if stats is None else stats.as_dict()
+
+
+def analyze_archive_args(args: Tuple[str, bool, Optional[ResultCache], MemberFilter]) -> Tuple[str, List[dict], Optional[str], Optional[dict]]:
+    return analyze_archive(*args)
+
+
+def analyze_archives(archives: Sequence[str], jobs: int = 1, streaming: bool = False, emit: Callable[[dict], None] = write_record, member_jobs: int = 1, cache: Optional[ResultCache] = None, archive_stats: Optional[Dict[str, dict]] = None, member_filter: MemberFilter = MemberFilter(), prefetch: int = 0, prefetch_bytes: int = 1 << 31) -> List[str]:
+    """
+    analyze archives on a pool of worker processes, records are emitted in
+    (archive, time) order, returns the archives that failed.
+    archive_stats turns on instrumentation and receives the statistics of each archive,
+    archives outside the time range of member_filter are skipped by name.
+    With jobs == 1, up to prefetch archives (and prefetch_bytes) are read ahead
+    in background threads
+    """
+    failed = []
+    instrument = archive_stats is not None
+    archives = [p for p in archives if member_filter.reads_archive(p)]
+
+    def emit_timed(record: dict):
+        with timed('emit'):
+            emit(record)
+
+    def report(p: str, error: Optional[str]):
+        if error is not None:
+            print(f'{p}: {error}', file=sys.stderr)
+            failed.append(p)
+
+    if jobs == 1:
+        loaded = ((p, None) for p in archives)
+        if prefetch > 0 and seek_index_dir is None:
+            decompress = reads_decompressed(streaming, member_filter)
+            loaded = Prefetcher(
+                archives,
+                lambda p: load_tar_outer(p, decompress),
+                lambda p: load_cost(p, decompress),
+                prefetch,
+                prefetch_bytes,
+            )
+        # write records as they are produced
+        with open_member_pool(member_jobs, instrument) as pool:
+            for p, future in loaded:
+                reset_stats(instrument)
+                try:
+                    inner = None
+                    if future is not None:
+                        with timed('prefetch_wait'):
+                            inner = future.result()
+                    if cache is None:
+                        read_tar_outer(p, streaming, emit_timed,
+                                       pool, member_filter, inner)
+                    else:
+                        read_tar_outer_cached(
+                            p, cache, streaming, emit_timed, pool, member_filter, inner)
+                except Exception as e:
+                    report(p, f'{type(e).__name__}: {e}')
+                if instrument:
+                    archive_stats[p] = stats.as_dict()
+    else:
+        with multiprocessing.Pool(jobs, initializer=init_worker, initargs=(backend.name, emit_histograms, instrument, seek_index_dir)) as pool:
+            # imap returns results in input order, regardless of which worker finishes first
+            results = pool.imap(analyze_archive_args,
+                                [(p, streaming, cache, member_filter) for p in archives])
+            for p, records, error, worker_stats in results:
+                reset_stats(instrument)
+                if worker_stats is not None:
+                    stats.merge(worker_stats)
+                for record in records:
+                    emit_timed(record)
+                report(p, error)
+                if instrument:
+                    archive_stats[p] = stats.as_dict()
+
+    if cache is not None:
+        cache.evict()
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('archives', nargs='*')
+    parser.add_argument('--file-list', type=argparse.FileType('r'),
+                        help='file with one archive per line, - for stdin')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='number of worker processes')
+    parser.add_argument('--output', '-o',
+                        help='result file, .npz for columnar arrays, .gz for gzipped JSON lines, JSON lines on stdout by default')
+    parser.add_argument('--histograms', action='store_true',
+                        help='write ADC histograms of each hitbuffer instead of hitrates, evaluate them with recalibrate.py')
+    parser.add_argument('--cache', type=Path,
+                        help='directory of the result cache, archives that did not change are not analyzed again')
+    parser.add_argument('--cache-size', type=float, default=4,
+                        help='size limit of the result cache in GB')
+    parser.add_argument('--cache-hash', action='store_true',
+                        help='identify archives by a hash of their content instead of size and modification time')
+    parser.add_argument('--member-jobs', type=int, default=1,
+                        help='number of worker processes for the hitbuffers within one archive')
+    parser.add_argument('--backend', choices=VERIFIED_BACKENDS, default=DEFAULT_BACKEND,
+                        help='hitbuffer analysis implementation')
+    parser.add_argument('--streaming', action='store_true',
+                        help='read the inner archive sequentially instead of decompressing it into memory')
+    parser.add_argument('--channels', type=int, nargs='+',
+                        help='only analyze these channels')
+    parser.add_argument('--start', type=datetime.datetime.fromisoformat,
+                        help='only analyze members from this time on, e.g. 2021-03-01T12:00')
+    parser.add_argument('--end', type=datetime.datetime.fromisoformat,
+                        help='only analyze members before this time')
+    parser.add_argument('--types', nargs='+', choices=['monitor', 'hitbuf'], default=['monitor', 'hitbuf'],
+                        help='member types to write records of, monitors are still read for the temperature of hitbuffers')
+    parser.add_argument('--monitor-only', action='store_true',
+                        help='same as --types monitor, hitbuffers are not decoded')
+    parser.add_argument('--seek-index', type=Path, metavar='DIR',
+                        help='read only the needed members through random access indices kept in DIR, built on first use')
+    parser.add_argument('--prefetch', type=int, default=0, metavar='N',
+                        help='read up to N archives ahead in background threads')
+    parser.add_argument('--prefetch-memory', type=float, default=2,
+                        help='memory limit of the archives read ahead in GB')
+    parser.add_argument('--stats',
+                        help='write per-stage timing and error counts as JSON to this file, - for stderr')
+    args = parser.parse_args()
+    if args.member_jobs > 1 and (args.jobs > 1 or args.streaming):
+        parser.error('--member-jobs can not be combined with --jobs or --streaming')
+    if args.seek_index is not None and (args.streaming or args.member_jobs > 1):
+        parser.error('--seek-index can not be combined with --streaming or --member-jobs')
+    if args.prefetch > 0 and (args.jobs > 1 or args.seek_index is not None):
+        parser.error('--prefetch can not be combined with --jobs or --seek-index')
+    if args.histograms and args.output is not None and args.output.endswith('.npz'):
+        parser.error('histograms can only be written as JSON lines')
+    if backend_error(args.backend, args.histograms) is not None:
+        parser.error(backend_error(args.backend, args.histograms))
+
+    archives = list(args.archives)
+    if args.file_list is not None:
+        archives += [line.strip() for line in args.file_list if line.strip()]
+    if not archives:
+        # archives = ['./data-hitbuf/scint-taxi-MicroDAQ_hitbuf_20210114.flat.tar']
+        # archives = ['./data-hitbuf/scint-taxi-MicroDAQ_hitbuf_20210125.flat.tar']
+        archives = ['./data-hitbuf/scint-taxi-MicroDAQ_hitbuf_20210302.flat.tar']
+
+    if args.seek_index is not None:
+        args.seek_index.mkdir(parents=True, exist_ok=True)
+    if args.monitor_only:
+        args.types = ['monitor']
+    member_filter = MemberFilter(
+        channels=None if args.channels is None else frozenset(args.channels),
+        start=args.start,
+        end=args.end,
+        types=frozenset(BinType[t.upper()] for t in args.types),
+    )
+
+    init_worker(args.backend, args.histograms, index_dir=args.seek_index)
+    cache = None
+    if args.cache is not None:
+        cache = ResultCache(args.cache, int(args.cache_size * 1e9),
+                            args.cache_hash)
+    archive_stats = None if args.stats is None else {}
+    start = time.perf_counter()
+    with result_store.open_writer(args.output, thresholds_mip) as writer:
+        failed = analyze_archives(
+            archives, args.jobs, args.streaming, writer.write, args.member_jobs, cache, archive_stats, member_filter,
+            args.prefetch, int(args.prefetch_memory * 1e9))
+
+    if archive_stats is not None:
+        total = Stats()
+        for s in archive_stats.values():
+            total.merge(s)
+        run_stats = {
+            'wall_s': time.perf_counter() - start,
+            'backend': backend.name,
+            'jobs': args.jobs,
+            'failed': failed,
+            'total': total.as_dict(),
+            'archives': archive_stats,
+        }
+        if args.stats == '-':
+            json.dump(run_stats, sys.stderr)
+            sys.stderr.write('\n')
+        else:
+            with open(args.stats, 'w') as f:
+                json.dump(run_stats, f, indent=1)
+    if failed:
+        print(f'{len(failed)} of {len(archives)} archives failed',
+              file=sys.stderr)
+        sys.exit(1)
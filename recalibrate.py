@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+"""
+turn the ADC histograms of read_data.py --histograms into hitrates for any
+panel calibration and set of MIP thresholds, without reading the raw archives
+"""
+import argparse
+import dataclasses
+import gzip
+import json
+import sys
+from typing import IO, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+import hitbuffer
+import read_data
+import result_store
+from read_data import Panel
+
+
+def load_panels(path: str) -> List[Panel]:
+    """ calibration file: JSON list with the fields of Panel for every channel """
+    with open(path) as f:
+        return [Panel(**{**p, 'adc_amp': tuple(p['adc_amp'])}) for p in json.load(f)]
+
+
+def fix_mip_temperature(panel: Panel, temperature: float) -> Panel:
+    """ evaluate pe/MIP at a constant temperature, equivalent to a pe threshold """
+    return dataclasses.replace(
+        panel,
+        mip_per_pe_offset=panel.mip_per_pe_offset +
+        panel.mip_per_pe_factor_temp * temperature,
+        mip_per_pe_factor_temp=0,
+    )
+
+
+def recalibrate(records: Iterable[dict], panels: Sequence[Panel], thresholds_mip: Sequence[float], auxdac: int = read_data.auxdac, skipped: Optional[List[dict]] = None) -> Iterator[dict]:
+    """
+    replace histogram records with hitrate records, monitor records are passed
+    through. Records that do not fit the calibration are reported and appended
+    to skipped
+    """
+    for record in records:
+        if 'histograms' not in record:
+            yield record
+            continue
+        if record['seconds'] == 0:
+            # no livetime (fewer than 2 hits), dropped by the direct analysis as well
+            continue
+        panel = panels[record['channel']]
+        try:
+            hits = hitbuffer.get_hits_from_histograms(
+                [(offset, np.array(hist)) for offset, hist in record['histograms']],
+                record['high_gain'],
+                panel.adc_amp,
+                record['baseline'],
+                panel.mip_per_adc0(record['temperature'], auxdac),
+                thresholds_mip,
+            )
+        except ValueError as e:
+            print(f'channel {record["channel"]} at {record["time"]}: {e}', file=sys.stderr)
+            if skipped is not None:
+                skipped.append(record)
+            continue
+        yield {
+            'channel': record['channel'],
+            'time': record['time'],
+            'results': [n / record['seconds'] for n in hits],
+        }
+
+
+def read_records(f: IO[str]) -> Iterator[dict]:
+    for line in f:
+        yield json.loads(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('histograms',
+                        help='output of read_data.py --histograms, JSON lines, optionally gzipped')
+    parser.add_argument('--output', '-o',
+                        help='result file, same formats as read_data.py')
+    parser.add_argument('--calibration',
+                        help='JSON file with a list of Panel fields per channel, defaults to read_data.panels')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=read_data.thresholds_mip,
+                        help='MIP thresholds')
+    parser.add_argument('--mip-temperature', type=float,
+                        help='evaluate pe/MIP at this constant temperature instead of the measured one')
+    args = parser.parse_args()
+
+    panels = read_data.panels
+    if args.calibration is not None:
+        panels = load_panels(args.calibration)
+    if args.mip_temperature is not None:
+        panels = [fix_mip_temperature(p, args.mip_temperature)
+                  for p in panels]
+
+    skipped: List[dict] = []
+    opener = gzip.open if args.histograms.endswith('.gz') else open
+    with opener(args.histograms, 'rt') as f, result_store.open_writer(args.output, args.thresholds) as writer:
+        for record in recalibrate(read_records(f), panels, args.thresholds, skipped=skipped):
+            writer.write(record)
+    if skipped:
+        print(f'{len(skipped)} histogram records skipped', file=sys.stderr)
+        sys.exit(1)
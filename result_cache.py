@@ -0,0 +1,90 @@
+"""
+Persistent cache of read_data.py records.
+
+One entry per (archive, channel, configuration fingerprint), so changing the
+calibration of one panel only invalidates that channel. Entries are gzipped
+JSON lines of [position of the member in the archive, record], the least
+recently used entries are evicted once the cache exceeds its size limit.
+"""
+import gzip
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from shared_files import atomic_path
+
+# part of the entry key, increment when the entry format changes
+ENTRY_VERSION = 2
+
+
+def file_digest(p: Path) -> str:
+    h = hashlib.sha256()
+    with open(p, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, directory: Path, max_bytes: int, hash_content: bool = False):
+        """
+        hash_content: identify archives by a hash of their content instead
+        of path, size and modification time
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hash_content = hash_content
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def archive_identity(self, archive: Path) -> str:
+        archive = Path(archive)
+        stat = archive.stat()
+        if self.hash_content:
+            return f'{stat.st_size}:{file_digest(archive)}'
+        return f'{archive.resolve()}:{stat.st_size}:{stat.st_mtime_ns}'
+
+    def entry(self, identity: str, channel: int, fingerprint: str) -> Path:
+        key = hashlib.sha256(
+            f'{ENTRY_VERSION}\n{identity}\n{channel}\n{fingerprint}'.encode()).hexdigest()
+        return self.directory / f'{key}.json.gz'
+
+    def get(self, identity: str, channel: int, fingerprint: str) -> Optional[List[Tuple[int, dict]]]:
+        path = self.entry(identity, channel, fingerprint)
+        try:
+            with gzip.open(path, 'rt') as f:
+                records = [tuple(json.loads(line)) for line in f]
+        except FileNotFoundError:
+            return None
+        # mark as recently used for eviction
+        os.utime(path)
+        return records
+
+    def put(self, identity: str, channel: int, fingerprint: str, records: List[Tuple[int, dict]]):
+        path = self.entry(identity, channel, fingerprint)
+        # write to a temporary file first so concurrent workers never read partial entries
+        with atomic_path(path) as tmp, gzip.open(tmp, 'wt') as f:
+            for record in records:
+                json.dump(record, f)
+                f.write('\n')
+
+    def evict(self):
+        """ remove least recently used entries until the cache fits into max_bytes """
+        entries = []
+        for path in self.directory.glob('*.json.gz'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,156 @@
+"""
+Output formats of read_data.py.
+
+JSON lines: one record per monitor or hitbuffer member, either
+    {"channel": c, "time": t, "temp": T} or {"channel": c, "time": t, "results": [rate per threshold]}
+npz: columnar arrays per channel c (read by plot/load.py)
+    thresholds_mip      (threshold,)
+    ch{c}_temp_time     (n,) unix time of monitor records
+    ch{c}_temp          (n,)
+    ch{c}_hits_time     (m,) unix time of hitbuffer records
+    ch{c}_hits_rate     (m, threshold) hitrate in 1/s
+"""
+import abc
+import gzip
+import json
+import os
+import sys
+import zipfile
+from typing import IO, List, Optional, Sequence
+
+import numpy as np
+
+from shared_files import tmp_path
+
+CHANNELS = 8
+# records per column kept as Python objects before they are packed into an array
+CHUNK_ROWS = 1 << 16
+
+
+class Writer(abc.ABC):
+    """
+    result files are written to a temporary file that replaces path on close.
+    As context manager, the output is discarded if the body raises.
+    """
+    path: Optional[str] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    @abc.abstractmethod
+    def _close_file(self):
+        """ finishes the temporary file (or flushes stdout) before it is moved or removed """
+
+    def close(self):
+        self._close_file()
+        if self.path is not None:
+            os.replace(tmp_path(self.path), self.path)
+
+    def abort(self):
+        self._close_file()
+        if self.path is not None:
+            try:
+                os.remove(tmp_path(self.path))
+            except FileNotFoundError:
+                pass
+
+
+class JsonLinesWriter(Writer):
+    def __init__(self, path: Optional[str]):
+        """ path None writes to stdout """
+        self.path = path
+        if path is None:
+            self.f: IO[str] = sys.stdout
+        elif path.endswith('.gz'):
+            self.f = gzip.open(tmp_path(path), 'wt')
+        else:
+            self.f = open(tmp_path(path), 'w')
+
+    def write(self, record: dict):
+        json.dump(record, self.f)
+        self.f.write('\n')
+
+    def _close_file(self):
+        if self.f is sys.stdout:
+            self.f.flush()
+        else:
+            self.f.close()
+
+
+class Column:
+    """ float64 rows appended one at a time, packed into arrays of CHUNK_ROWS rows """
+
+    def __init__(self, width: Optional[int] = None):
+        self.shape = (-1,) if width is None else (-1, width)
+        self.rows: List = []
+        self.chunks: List[np.ndarray] = [np.empty(0).reshape(self.shape)]
+
+    def append(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= CHUNK_ROWS:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.chunks.append(np.array(self.rows, dtype=np.float64).reshape(self.shape))
+            self.rows = []
+
+    def array(self) -> np.ndarray:
+        self.flush()
+        array = np.concatenate(self.chunks)
+        self.chunks = []
+        return array
+
+
+def write_array(z: zipfile.ZipFile, key: str, array: np.ndarray):
+    with z.open(key + '.npy', 'w', force_zip64=True) as f:
+        np.lib.format.write_array(f, array, allow_pickle=False)
+
+
+class NpzWriter(Writer):
+    def __init__(self, path: str, thresholds_mip: Sequence[float]):
+        self.path = path
+        self.thresholds_mip = list(thresholds_mip)
+        self.columns = {}
+        for c in range(CHANNELS):
+            self.columns[f'ch{c}_temp_time'] = Column()
+            self.columns[f'ch{c}_temp'] = Column()
+            self.columns[f'ch{c}_hits_time'] = Column()
+            self.columns[f'ch{c}_hits_rate'] = Column(len(self.thresholds_mip))
+
+    def write(self, record: dict):
+        channel = record['channel']
+        if 'results' in record:
+            self.columns[f'ch{channel}_hits_time'].append(record['time'])
+            self.columns[f'ch{channel}_hits_rate'].append(record['results'])
+        elif 'temp' in record:
+            self.columns[f'ch{channel}_temp_time'].append(record['time'])
+            self.columns[f'ch{channel}_temp'].append(record['temp'])
+
+    def _close_file(self):
+        pass
+
+    def close(self):
+        # same layout as np.savez, but only one column is concatenated at a time.
+        # Uncompressed, so loading is a plain read
+        with zipfile.ZipFile(tmp_path(self.path), 'w', zipfile.ZIP_STORED, allowZip64=True) as z:
+            write_array(z, 'thresholds_mip', np.array(self.thresholds_mip))
+            for key, column in self.columns.items():
+                write_array(z, key, column.array())
+        self.columns = {}
+        super().close()
+
+
+def open_writer(path: Optional[str], thresholds_mip: Sequence[float]) -> Writer:
+    """ pick the format from the file name, None writes JSON lines to stdout """
+    if path is None or path == '-':
+        return JsonLinesWriter(None)
+    if path.endswith('.npz'):
+        return NpzWriter(path, thresholds_mip)
+    return JsonLinesWriter(path)
@@ -8,4 +8,4 @@ SCRATCHDIR=/scratch/mpittermann/analyze_hitbuffer/
 rsync -av --delete --filter=':- .gitignore' $PWD/ $COBALT:$ROOTDIR
 
 # run analysis
-ssh $COBALT "source ~/source_python37.sh && cd $ROOTDIR && cat files_2021.txt | parallel -j 16 python3 read_data.py | gzip > $SCRATCHDIR/result.json.gz"
+ssh $COBALT "source ~/source_python37.sh && cd $ROOTDIR && python3 read_data.py --jobs 16 --file-list files_2021.txt | gzip > $SCRATCHDIR/result.json.gz"
@@ -0,0 +1,204 @@
+#!/usr/bin/python3
+"""
+Random access to the members of the inner .tgz of an archive.
+
+The sidecar index of an archive consists of <archive>.members.json with the
+offset and size of every member in the decompressed inner tar, and, if the
+indexed_gzip package is installed, <archive>.gzidx with gzip restart points.
+With restart points a member is read with a seek and a short decompression,
+without them the inner archive is decompressed up to the member.
+"""
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import tarfile
+from pathlib import Path
+from typing import IO, Iterable, Iterator, Optional, Tuple
+
+from shared_files import atomic_path, file_stamp, write_json
+
+try:
+    import indexed_gzip
+except ImportError:
+    indexed_gzip = None
+
+# uncompressed bytes between restart points, each point stores a 32 KiB window
+SPACING = 1 << 20
+# read buffer after a seek, keeps reads of small members short
+BUFFER_SIZE = 1 << 16
+# upper limit of the bytes read at once for neighbouring members
+MAX_READ = 1 << 26
+
+
+class ArchiveSlice(io.RawIOBase):
+    """ read-only file view of the bytes [offset, offset + size) of f """
+
+    def __init__(self, f: IO[bytes], offset: int, size: int):
+        self.f = f
+        self.offset = offset
+        self.size = size
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, position: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            position += self.position
+        elif whence == io.SEEK_END:
+            position += self.size
+        self.position = position
+        return position
+
+    def readinto(self, b) -> int:
+        n = max(0, min(len(b), self.size - self.position))
+        self.f.seek(self.offset + self.position)
+        data = self.f.read(n)
+        b[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+class ArchiveIndex:
+    def __init__(self, archive: Path, inner: str, directory: Optional[Path] = None):
+        """
+        index of the member inner of archive, stored in directory, next to
+        the archive by default. It is built if it is missing or outdated.
+        """
+        self.archive = Path(archive)
+        self.inner = inner
+        directory = self.archive.parent if directory is None else Path(directory)
+        self.members_file = directory / (self.archive.name + '.members.json')
+        self.gzip_index_file = directory / (self.archive.name + '.gzidx')
+        index = self._load()
+        if index is None:
+            index = self.build()
+        self.inner_offset = index['inner_offset']
+        self.inner_size = index['inner_size']
+        self.restart_points = index['restart_points']
+        self.members = []
+        for name, offset_data, size in index['members']:
+            info = tarfile.TarInfo(name)
+            info.offset_data = offset_data
+            info.size = size
+            self.members.append(info)
+
+    def _load(self) -> Optional[dict]:
+        try:
+            with open(self.members_file) as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if index['archive'] != file_stamp(self.archive) or index['inner'] != self.inner:
+            return None
+        # restart points are added once indexed_gzip is available
+        if indexed_gzip is not None and not index['restart_points']:
+            return None
+        if index['restart_points'] and not self.gzip_index_file.exists():
+            return None
+        return index
+
+    def build(self) -> dict:
+        """ one sequential pass over the inner archive """
+        with tarfile.open(self.archive) as tar:
+            info = tar.getmember(self.inner)
+        index = {
+            'archive': file_stamp(self.archive),
+            'inner': self.inner,
+            'inner_offset': info.offset_data,
+            'inner_size': info.size,
+            'restart_points': indexed_gzip is not None,
+        }
+        with open(self.archive, 'rb') as f:
+            compressed = ArchiveSlice(f, info.offset_data, info.size)
+            if indexed_gzip is None:
+                with tarfile.open(fileobj=compressed, mode='r|gz') as tar:
+                    index['members'] = [[m.name, m.offset_data, m.size] for m in tar]
+            else:
+                with indexed_gzip.IndexedGzipFile(fileobj=compressed, spacing=SPACING, buffer_size=BUFFER_SIZE) as inner:
+                    with tarfile.open(fileobj=inner, mode='r:') as tar:
+                        index['members'] = [[m.name, m.offset_data, m.size]
+                                            for m in tar.getmembers()]
+                    inner.build_full_index()
+                    with atomic_path(self.gzip_index_file) as tmp:
+                        inner.export_index(str(tmp))
+        # written last, marks the index as complete
+        write_json(self.members_file, index, indent=None)
+        return index
+
+    @contextlib.contextmanager
+    def open(self) -> Iterator[IO[bytes]]:
+        """
+        seekable decompressed inner archive. Without restart points, seeking
+        backwards decompresses from the start again.
+        """
+        with open(self.archive, 'rb') as f:
+            compressed = ArchiveSlice(f, self.inner_offset, self.inner_size)
+            if self.restart_points:
+                inner = indexed_gzip.IndexedGzipFile(
+                    fileobj=compressed, spacing=SPACING, buffer_size=BUFFER_SIZE,
+                    index_file=str(self.gzip_index_file))
+            else:
+                inner = gzip.GzipFile(fileobj=compressed, mode='rb')
+            with inner:
+                yield inner
+
+    def extract(self, members: Iterable[tarfile.TarInfo]) -> Iterator[Tuple[tarfile.TarInfo, bytes]]:
+        """
+        content of members in archive order. Neighbouring members are read
+        with one call, every read decompresses from the last restart point.
+        """
+        members = sorted(members, key=lambda info: info.offset_data)
+        with self.open() as inner:
+            start = 0
+            while start < len(members):
+                first = members[start].offset_data
+                end = start + 1
+                while end < len(members) and \
+                        members[end].offset_data - first < MAX_READ and \
+                        members[end].offset_data - members[end - 1].offset_data - members[end - 1].size < SPACING:
+                    end += 1
+                last = members[end - 1]
+                inner.seek(first)
+                data = inner.read(last.offset_data + last.size - first)
+                for info in members[start:end]:
+                    yield info, data[info.offset_data - first:info.offset_data - first + info.size]
+                start = end
+
+
+if __name__ == '__main__':
+    from read_data import inner_name
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('archives', nargs='+', type=Path)
+    parser.add_argument('--index-dir', type=Path,
+                        help='directory of the index files, next to the archives by default')
+    parser.add_argument('--list', action='store_true',
+                        help='print the members of the archives')
+    parser.add_argument('--extract', nargs='+', default=[], metavar='MEMBER',
+                        help='write these members of the archive to the output directory')
+    parser.add_argument('--output', '-o', type=Path, default=Path('.'),
+                        help='output directory of --extract')
+    args = parser.parse_args()
+
+    for archive in args.archives:
+        index = ArchiveIndex(archive, inner_name(archive), args.index_dir)
+        if args.list:
+            for info in index.members:
+                print(info.name, info.size)
+        if args.extract:
+            by_name = {info.name: info for info in index.members}
+            missing = [name for name in args.extract if name not in by_name]
+            if missing:
+                parser.error(f'not in {archive}: {", ".join(missing)}')
+            args.output.mkdir(parents=True, exist_ok=True)
+            for info, data in index.extract(by_name[name] for name in args.extract):
+                (args.output / info.name).write_bytes(data)
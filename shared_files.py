@@ -0,0 +1,66 @@
+"""
+Files shared between processes and hosts: written atomically under a
+temporary name, and checked for changes by size and modification time.
+"""
+import contextlib
+import json
+import os
+import shutil
+import socket
+from pathlib import Path
+from typing import IO, Iterator, Union
+
+
+def tmp_path(path: Union[str, Path]) -> Path:
+    """ hidden file next to path, unique across the hosts sharing the directory """
+    path = Path(path)
+    return path.with_name(f'.{path.name}.{socket.gethostname()}.{os.getpid()}.tmp')
+
+
+def remove(path: Path):
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        with contextlib.suppress(FileNotFoundError):
+            path.unlink()
+
+
+@contextlib.contextmanager
+def atomic_path(path: Union[str, Path]) -> Iterator[Path]:
+    """
+    temporary path to write a file or directory to, which replaces path as a
+    whole when the body returns. Readers never see a partial version (of a
+    directory, there is none for a moment) and memory maps of the old one stay
+    valid. Nothing is replaced if the body raises
+    """
+    path = Path(path)
+    tmp = tmp_path(path)
+    old = tmp.with_name(tmp.name + '.old')
+    remove(tmp)
+    try:
+        yield tmp
+        if tmp.is_dir() and path.is_dir():
+            # a directory only replaces an empty one
+            os.replace(path, old)
+        os.replace(tmp, path)
+    finally:
+        remove(tmp)
+        remove(old)
+
+
+@contextlib.contextmanager
+def atomic_write(path: Union[str, Path], mode: str = 'w') -> Iterator[IO]:
+    """ open(path, mode), path is replaced when the body returns """
+    with atomic_path(path) as tmp, open(tmp, mode) as f:
+        yield f
+
+
+def write_json(path: Union[str, Path], data, indent: int = 1):
+    with atomic_write(path) as f:
+        json.dump(data, f, indent=indent)
+
+
+def file_stamp(path: Union[str, Path]) -> dict:
+    """ changes whenever path is rewritten """
+    stat = Path(path).stat()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
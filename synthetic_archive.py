@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+"""
+write synthetic MicroDAQ archives in the layout read_data.py expects:
+scint-taxi-MicroDAQ_hitbuf_YYYYMMDD.flat.tar containing the .tgz with COBS
+framed hitbuffer, monitor and config members.
+
+The hit records are written with hitbuffer.HIT_DTYPE, the unverified
+reconstruction of the udaq_analysis_lib format. Results on these archives
+(benchmark.py, comparisons of backends or against a saved baseline) are
+therefore circular: they measure speed and catch changes, but can not show
+that the format itself is wrong. Only real hitbuffers can, see
+check_backend.py --record and the fixtures of test_backends.py.
+"""
+import argparse
+import datetime
+import gzip
+import io
+import struct
+import tarfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+from cobs import cobs
+
+import hitbuffer
+from read_data import OK_STR
+
+
+@dataclass
+class ArchiveConfig:
+    channels: int = 8
+    # hitbuffer readouts per channel and day
+    hitbuffers: int = 144
+    # hits per hitbuffer
+    hits: int = 20000
+    # monitor file every n hitbuffers
+    monitor_every: int = 6
+    # hit records per COBS block
+    block_hits: int = 100
+    # fraction of hitbuffers that are damaged
+    corruption: float = 0.0
+    # trigger rate and fraction of CPU triggers
+    rate_hz: float = 500
+    cpu_fraction: float = 0.1
+
+
+def encode_frame(payload: bytes) -> bytes:
+    # decode_cobs drops the first byte and checks the trailing Fletcher-16
+    packet = b'\x01' + payload
+    packet += struct.pack('<H', hitbuffer.fletcher_16(packet))
+    return cobs.encode(packet) + b'\0'
+
+
+def make_hits(rng: np.random.Generator, config: ArchiveConfig, temperature: float) -> np.ndarray:
+    n = config.hits
+    hits = np.zeros(n, dtype=hitbuffer.HIT_DTYPE)
+    ticks = rng.exponential(hitbuffer.CLOCK_HZ / config.rate_hz, n)
+    hits['time'] = (np.cumsum(ticks) + rng.integers(1 << 32)).astype(np.uint64) % (1 << 32)
+    cpu = rng.random(n) < config.cpu_fraction
+    hits['flags'] = np.where(cpu, hitbuffer.FLAG_CPU_TRIGGER, 0)
+    # dark noise plus a MIP peak, about 1240 ADC per MIP in the high gain
+    # stage and 12.4 times less in the low gain stage, gain drops with temperature
+    gain = 1240 * (1 - 0.002 * (temperature - 250))
+    mip = np.where(rng.random(n) < 0.3,
+                   rng.lognormal(0, 0.3, n), rng.exponential(0.3, n))
+    signal = np.where(cpu, 0, mip * gain)
+    adc = np.empty((n, 2))
+    adc[:, 0] = rng.normal(200, 4, n) + signal
+    adc[:, 1] = rng.normal(300, 4, n) + signal / 12.4
+    hits['adc'] = np.clip(adc, 0, 4095).astype(np.uint16)
+    return hits
+
+
+def corrupt(rng: np.random.Generator, frames: List[bytes]) -> List[bytes]:
+    kind = rng.integers(3)
+    if kind == 0:
+        # flip a byte, the checksum or the COBS structure breaks
+        i = int(rng.integers(1, len(frames) - 1))
+        frame = bytearray(frames[i])
+        j = int(rng.integers(len(frame) - 1))
+        frame[j] = (frame[j] + 1) % 255 + 1
+        frames[i] = bytes(frame)
+    elif kind == 1:
+        # lose a block
+        del frames[int(rng.integers(1, len(frames) - 1))]
+    else:
+        # readout interrupted before the OK
+        del frames[-1]
+    return frames
+
+
+def make_hitfile(rng: np.random.Generator, config: ArchiveConfig, temperature: float) -> bytes:
+    data = make_hits(rng, config, temperature).tobytes()
+    block_size = config.block_hits * hitbuffer.HIT_DTYPE.itemsize
+    blocks = [data[i:i + block_size] for i in range(0, len(data), block_size)]
+    frames = [encode_frame(struct.pack('<H', len(blocks)))]
+    frames += [encode_frame(block) for block in blocks]
+    frames.append(encode_frame(OK_STR))
+    if rng.random() < config.corruption:
+        frames = corrupt(rng, frames)
+    return b''.join(frames)
+
+
+def make_monitor(time: datetime.datetime, temperature: float) -> bytes:
+    tai = (f'TAI: {time.year - 2000} {time.timetuple().tm_yday} {time.hour} {time.minute} {time.second} '
+           f'{time.hour * 3600 + time.minute * 60 + time.second}\tCLK: 0\n\0')
+    return encode_frame(b'STATUS OK\n\0') + \
+        encode_frame(f'0.0000 {temperature:.2f} 0.0000\n\0'.encode()) + \
+        encode_frame(tai.encode())
+
+
+def make_members(day: datetime.date, config: ArchiveConfig, seed: int) -> List[Tuple[str, bytes]]:
+    rng = np.random.default_rng(seed)
+    start = datetime.datetime(day.year, day.month, day.day)
+    interval = datetime.timedelta(days=1) / config.hitbuffers
+    members = []
+    for channel in range(config.channels):
+        stamp = start.strftime('%Y%m%d_%H%M%S')
+        members.append((f'MicroDAQ_config_{channel}_{stamp}.txt',
+                        encode_frame(b'AUXDAC 2650\n\0')))
+        for i in range(config.hitbuffers):
+            time = start + i * interval + \
+                datetime.timedelta(seconds=int(rng.integers(60)))
+            stamp = time.strftime('%Y%m%d_%H%M%S')
+            # daily temperature cycle around 250 K
+            temperature = 250 + 5 * np.sin(2 * np.pi * i / config.hitbuffers) + channel
+            if i % config.monitor_every == 0:
+                members.append((f'MicroDAQ_monitor_{channel}_{stamp}.txt',
+                                make_monitor(time, temperature)))
+                time += datetime.timedelta(seconds=1)
+                stamp = time.strftime('%Y%m%d_%H%M%S')
+            members.append((f'MicroDAQ_hitbuf_{channel}_{stamp}.bin',
+                            make_hitfile(rng, config, temperature)))
+    # archive order is by name, not by time
+    members.sort()
+    return members
+
+
+def add_member(tar: tarfile.TarFile, name: str, data: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = 0
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_archive(directory: Path, day: datetime.date, config: ArchiveConfig = ArchiveConfig(), seed: int = 0) -> Path:
+    name = f'scint-taxi-MicroDAQ_hitbuf_{day:%Y%m%d}'
+    inner = io.BytesIO()
+    with tarfile.open(fileobj=inner, mode='w') as tar:
+        for member_name, data in make_members(day, config, seed):
+            add_member(tar, member_name, data)
+    path = Path(directory) / f'{name}.flat.tar'
+    with tarfile.open(path, 'w') as tar:
+        add_member(tar, name + '.tgz', gzip.compress(inner.getvalue()))
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory', type=Path)
+    parser.add_argument('--start', type=datetime.date.fromisoformat,
+                        default=datetime.date(2021, 3, 1))
+    parser.add_argument('--days', type=int, default=1)
+    parser.add_argument('--channels', type=int, default=8)
+    parser.add_argument('--hitbuffers', type=int, default=144,
+                        help='hitbuffers per channel and day')
+    parser.add_argument('--hits', type=int, default=20000,
+                        help='hits per hitbuffer')
+    parser.add_argument('--corruption', type=float, default=0.0,
+                        help='fraction of damaged hitbuffers')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    config = ArchiveConfig(channels=args.channels, hitbuffers=args.hitbuffers,
+                           hits=args.hits, corruption=args.corruption)
+    args.directory.mkdir(parents=True, exist_ok=True)
+    for i in range(args.days):
+        day = args.start + datetime.timedelta(days=i)
+        print(write_archive(args.directory, day, config, args.seed + i))
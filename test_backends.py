@@ -0,0 +1,83 @@
+"""
+conformance of the NumPy backend with the C++ udaq_analysis_lib, run with
+python -m pytest. The synthetic archives are written with the hitbuffer format
+of hitbuffer.py, so only the recorded real hitbuffers in fixtures/hitbuffers
+(see check_backend.py --record) can show that this format is wrong. Tests that
+need udaq_analysis_lib are skipped where it is not installed.
+"""
+import datetime
+import json
+import math
+from pathlib import Path
+
+import pytest
+
+import check_backend
+import read_data
+import synthetic_archive
+
+CONFIG = synthetic_archive.ArchiveConfig(
+    channels=2, hitbuffers=12, hits=2000, monitor_every=3, corruption=0.1)
+FIXTURES = Path(__file__).parent / 'fixtures' / 'hitbuffers'
+
+requires_cpp = pytest.mark.skipif(
+    'cpp' not in read_data.backends, reason='udaq_analysis_lib is not installed')
+
+
+def recorded_hitbuffers() -> list:
+    fixtures = sorted(FIXTURES.glob('*.json'))
+    if not fixtures:
+        # the NumPy backend stays unverified and unselectable until then
+        return [pytest.param(None, id='none', marks=pytest.mark.skip(
+            reason='no recorded hitbuffers, see check_backend.py --record'))]
+    return fixtures
+
+
+@pytest.fixture(scope='module')
+def archive(tmp_path_factory) -> str:
+    directory = tmp_path_factory.mktemp('archives')
+    return str(synthetic_archive.write_archive(directory, datetime.date(2021, 3, 1), CONFIG))
+
+
+def analyze(archive: str, backend: str, histograms: bool = False) -> list:
+    read_data.init_worker(backend, histograms)
+    _, records, error, _ = read_data.analyze_archive(archive)
+    assert error is None
+    return records
+
+
+@pytest.mark.parametrize('fixture', recorded_hitbuffers(), ids=lambda p: p.stem)
+def test_recorded_hitbuffer(fixture: Path):
+    with open(fixture) as f:
+        expected = json.load(f)
+    numpy = read_data.backends['numpy']
+    read_data.set_backend('numpy')
+    # the raw member is stored next to its results
+    data = read_data.decode_cobs_hitfile(fixture.with_suffix('').read_bytes())
+    baseline = numpy.get_baseline(data, read_data.max_adc_counts)
+    assert [list(b) for b in baseline] == expected['baseline']
+    data, adc_amp, baseline_adc, mip_per_adc0, _, max_adc_counts = check_backend.hitrate_args(
+        data, baseline, expected['temperature'], expected['channel'])
+    results = numpy.get_hitrates_thresh(
+        data, adc_amp, baseline_adc, mip_per_adc0, expected['thresholds_mip'], max_adc_counts)
+    for (seconds, hits), (seconds_cpp, hits_cpp) in zip(results, expected['results']):
+        assert hits == hits_cpp
+        assert math.isclose(seconds, seconds_cpp, rel_tol=1e-9)
+
+
+@requires_cpp
+def test_hitbuffers(archive):
+    # checksums, baseline and hit counts of every hitbuffer
+    assert check_backend.check_archive(archive, None) == 0
+
+
+@requires_cpp
+def test_records(archive):
+    cpp, numpy = analyze(archive, 'cpp'), analyze(archive, 'numpy')
+    assert len(cpp) == len(numpy) > 0
+    for a, b in zip(cpp, numpy):
+        assert (a['channel'], a['time']) == (b['channel'], b['time'])
+        if 'results' in a:
+            assert all(math.isclose(x, y, rel_tol=1e-9) for x, y in zip(a['results'], b['results']))
+        else:
+            assert a['temp'] == b['temp']
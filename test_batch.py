@@ -0,0 +1,56 @@
+"""
+plan, work and merge of batch.py with local workers, run with python -m pytest.
+The workers use the NumPy backend, the shard bookkeeping does not depend on it
+"""
+import datetime
+import gzip
+import json
+
+import batch
+import read_data
+import synthetic_archive
+
+CONFIG = synthetic_archive.ArchiveConfig(
+    channels=2, hitbuffers=6, hits=500, monitor_every=2, corruption=0.2)
+
+
+def test_local_workers(tmp_path):
+    archives = [
+        str(synthetic_archive.write_archive(tmp_path, datetime.date(2021, 3, 1 + i), CONFIG, seed=i))
+        for i in range(3)
+    ]
+    run = batch.Run.create(tmp_path / 'run', archives, 1, 'numpy', False)
+    workers = batch.LocalLauncher(2).start(['work', str(run.directory)])
+    assert [worker.wait() for worker in workers] == [0, 0]
+    assert batch.shard_states(run, 3, 1800) == ['done'] * 3
+
+    output = tmp_path / 'result.json.gz'
+    assert batch.merge(run, str(output)) == []
+    with gzip.open(output, 'rt') as f:
+        merged = [json.loads(line) for line in f]
+
+    read_data.init_worker('numpy', False)
+    expected = []
+    assert read_data.analyze_archives(archives, emit=expected.append) == []
+    assert merged == expected
+
+
+def test_lock_owner(tmp_path):
+    run = batch.Run.create(tmp_path / 'run', ['a', 'b'], 1, 'numpy', False)
+    token = run.claim(0, 1800)
+    assert token is not None and run.claim(0, 1800) is None
+    lock = run.path(0, '.lock')
+
+    # renamed aside by a worker that checks whether it is stale
+    lock.rename(lock.with_name('aside'))
+    assert run.touch(0, token)
+    lock.with_name('aside').rename(lock)
+
+    # taken over: the old owner neither touches nor releases it
+    lock.unlink()
+    other = run.claim(0, 1800)
+    assert not run.touch(0, token)
+    run.release(0, token)
+    assert run.owner(0) == other
+    run.release(0, other)
+    assert not lock.exists()
@@ -0,0 +1,63 @@
+"""
+records served by the result cache equal those of an uncached analysis, run
+with python -m pytest. The NumPy backend is used, the cache does not depend on it
+"""
+import datetime
+import gzip
+import io
+import random
+import tarfile
+
+import pytest
+
+import read_data
+import synthetic_archive
+from result_cache import ResultCache
+
+CONFIG = synthetic_archive.ArchiveConfig(
+    channels=3, hitbuffers=8, hits=500, monitor_every=2, corruption=0.1)
+
+
+@pytest.fixture(scope='module')
+def archive(tmp_path_factory) -> str:
+    """
+    members in shuffled archive order, with the seconds of every time zeroed
+    so that members of different channels and types share times
+    """
+    directory = tmp_path_factory.mktemp('archives')
+    path = synthetic_archive.write_archive(directory, datetime.date(2021, 3, 1), CONFIG)
+    name = read_data.inner_name(path)
+    with tarfile.open(path) as outer:
+        inner = io.BytesIO(gzip.decompress(outer.extractfile(name).read()))
+    with tarfile.open(fileobj=inner) as tar:
+        members = [(info.name, tar.extractfile(info).read()) for info in tar.getmembers()]
+    random.Random(0).shuffle(members)
+    shuffled = io.BytesIO()
+    with tarfile.open(fileobj=shuffled, mode='w') as tar:
+        for member_name, data in members:
+            # MicroDAQ_<type>_<channel>_YYYYMMDD_HHMMSS.<ext>
+            head, _, hms = member_name.rpartition('_')
+            synthetic_archive.add_member(tar, f'{head}_{hms[:4]}00{hms[6:]}', data)
+    with tarfile.open(path, 'w') as outer:
+        synthetic_archive.add_member(outer, name, gzip.compress(shuffled.getvalue()))
+    return str(path)
+
+
+def analyze(archive: str, cache, **kwargs) -> list:
+    records = []
+    assert read_data.analyze_archives([archive], emit=records.append, cache=cache, **kwargs) == []
+    return records
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_cold_and_warm(archive, tmp_path, streaming):
+    read_data.init_worker('numpy', False)
+    expected = analyze(archive, None, streaming=streaming)
+    assert expected
+    cache = ResultCache(tmp_path / 'cache', 1 << 30)
+    # channel 1 cached first, then the others are analyzed and merged with it
+    channel = read_data.MemberFilter(channels=frozenset({1}))
+    assert analyze(archive, cache, streaming=streaming, member_filter=channel) == \
+        analyze(archive, None, streaming=streaming, member_filter=channel)
+    assert analyze(archive, cache, streaming=streaming) == expected
+    assert analyze(archive, cache, streaming=streaming) == expected
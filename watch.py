@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+"""
+Follow directories for new or changed archives and analyze only those.
+
+Every archive gets its own segment, STORE/segments/<archive>.npz, written
+atomically. STORE/manifest.json records the size and modification time of
+each processed archive and is replaced after every segment, so after a crash
+an archive is either complete in the store or analyzed again, never half or
+twice. plot/load.py reads the store directory like a result file.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import read_data
+import result_store
+from shared_files import file_stamp, write_json
+
+MANIFEST_VERSION = 1
+PATTERN = 'scint-taxi-MicroDAQ_hitbuf_*.flat.tar'
+
+
+def segment_name(p: Path) -> str:
+    """ archives of the same name under different roots get their own segment """
+    name, _, _ = p.name.partition('.flat.tar')
+    path_hash = hashlib.sha256(str(p.resolve()).encode()).hexdigest()[:12]
+    return f'{name}.{path_hash}.npz'
+
+
+class Store:
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.segments = self.directory / 'segments'
+        self.segments.mkdir(parents=True, exist_ok=True)
+        self.manifest_file = self.directory / 'manifest.json'
+        try:
+            with open(self.manifest_file) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {'version': MANIFEST_VERSION, 'archives': {}}
+        # segments of an interrupted run
+        for tmp in self.segments.glob('.*.tmp'):
+            tmp.unlink()
+
+    def is_current(self, p: Path, stamp: dict) -> bool:
+        entry = self.manifest['archives'].get(str(p))
+        return entry is not None and entry['stamp'] == stamp
+
+    def add(self, p: Path, stamp: dict, records: List[dict], error: Optional[str]):
+        """
+        failed archives are recorded with their error and analyzed again
+        once they change
+        """
+        segment = None
+        if error is None:
+            segment = segment_name(p)
+            with result_store.open_writer(str(self.segments / segment), read_data.thresholds_mip) as writer:
+                for record in records:
+                    writer.write(record)
+        self.manifest['archives'][str(p)] = {
+            'stamp': stamp,
+            'segment': segment,
+            'error': error,
+        }
+        write_json(self.manifest_file, self.manifest)
+
+
+def find_archives(roots: Sequence[Path]) -> List[Path]:
+    return sorted(p for root in roots for p in Path(root).rglob(PATTERN))
+
+
+def settled(stamp: dict, settle: float) -> bool:
+    """ archives still being copied are picked up by a later poll """
+    return time.time() - stamp['mtime_ns'] / 1e9 >= settle
+
+
+def pending_archives(roots: Sequence[Path], store: Store, settle: float) -> Iterator[Path]:
+    for p in find_archives(roots):
+        stamp = file_stamp(p)
+        if settled(stamp, settle) and not store.is_current(p, stamp):
+            yield p
+
+
+def ingest(archives: List[Path], store: Store, jobs: int = 1) -> int:
+    """ analyze archives into the store, returns the number of failed archives """
+    stamps: Dict[Path, dict] = {p: file_stamp(p) for p in archives}
+    tasks = [(str(p), False, None) for p in archives]
+    failed = 0
+
+    def add(p: str, records: List[dict], error: Optional[str]):
+        nonlocal failed
+        if error is not None:
+            print(f'{p}: {error}', file=sys.stderr)
+            failed += 1
+        store.add(Path(p), stamps[Path(p)], records, error)
+
+    if jobs == 1:
+        for task in tasks:
+            p, records, error, _ = read_data.analyze_archive(*task)
+            add(p, records, error)
+    else:
+        with multiprocessing.Pool(jobs, initializer=read_data.init_worker, initargs=(read_data.backend.name, False)) as pool:
+            for p, records, error, _ in pool.imap(read_data.analyze_archive_args, tasks):
+                add(p, records, error)
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('roots', nargs='+', type=Path,
+                        help='directories searched recursively for archives')
+    parser.add_argument('--store', type=Path, required=True,
+                        help='directory of the segments and the manifest')
+    parser.add_argument('--interval', type=float, default=600,
+                        help='seconds between polls')
+    parser.add_argument('--settle', type=float, default=60,
+                        help='seconds an archive must be unmodified before it is analyzed')
+    parser.add_argument('--once', action='store_true',
+                        help='process the pending archives and exit')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='number of worker processes')
+    parser.add_argument('--backend', choices=read_data.VERIFIED_BACKENDS, default=read_data.DEFAULT_BACKEND,
+                        help='hitbuffer analysis implementation')
+    args = parser.parse_args()
+    if read_data.backend_error(args.backend) is not None:
+        parser.error(read_data.backend_error(args.backend))
+
+    read_data.init_worker(args.backend, False)
+    store = Store(args.store)
+    while True:
+        pending = list(pending_archives(args.roots, store, args.settle))
+        failed = 0
+        if pending:
+            print(f'{len(pending)} new or changed archives', file=sys.stderr)
+            failed = ingest(pending, store, args.jobs)
+        if args.once:
+            sys.exit(1 if failed else 0)
+        time.sleep(args.interval)